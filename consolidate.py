@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+import os, sys
+import argparse
+
+__author__ = "Miguel Ponce de Leon"
+__copyright__ = "Copyright 2020, Tools for PhysiCell project"
+__credits__ = ["Miguel Ponce de Leon"]
+__license__ = "GPL 3.0"
+__version__ = "0.1.0"
+__maintainer__ = "Miguel Ponce de Leon"
+__email__ = "miguel.ponce@bsc.es"
+__status__ = "dev"
+
+modules_path = os.path.dirname(os.path.realpath(__file__))
+modules_path = os.path.join(modules_path, 'modules')
+sys.path.append(modules_path)
+
+import multicellds
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(description="Consolidate the cells of all the snapshots of a PhysiCell output folder into a columnar store")
+
+    parser.add_argument("data_folder", action="store", help="folder were the data is stored")
+
+    parser.add_argument("--workers", action="store", dest="workers", type=int, default=1,
+                        help="Number of snapshots processed in parallel")
+
+    parser.add_argument("--no-compress", action="store_false", dest="compress",
+                        help="Store the partitions without compression")
+
+    parser.add_argument("--microenvironment", action="store_true", dest="microenvironment",
+                        help="Also write one (time x voxels) cube per substrate of the microenvironment")
+
+    return parser
+
+
+def main(argv=None):
+    parser = create_parser()
+    args = parser.parse_args(argv)
+
+    mcds = multicellds.MultiCellDS(output_folder=args.data_folder)
+    print("Consolidating %i snapshots from %s" % (mcds.cells_file_count(), args.data_folder))
+    written = mcds.consolidate(compress=args.compress, workers=args.workers)
+    print("%i new partitions written into %s" % (written, os.path.join(args.data_folder, mcds.store_folder_name)))
+
+    if args.microenvironment:
+        print("Writing the substrate cubes of %s" % ", ".join(mcds.substrates))
+        written = mcds.consolidate_microenvironment(workers=args.workers)
+        print("%i time steps written into %s" % (written, os.path.join(args.data_folder, mcds.microenvironment_store_folder_name)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+import os
+import struct
+import numpy as np
+
+__author__ = "Miguel Ponce de Leon"
+__copyright__ = "Copyright 2020, Tools for PhysiCell project"
+__credits__ = ["Miguel Ponce de Leon"]
+__license__ = "GNU"
+__version__ = "0.1.0"
+__maintainer__ = "Miguel Ponce de Leon"
+__email__ = "miguel.ponce@bsc.es"
+__status__ = "dev"
+
+
+# MAT level 4 precision digit (P in MOPT) to numpy type
+mat4_dtypes = {0: "f8", 1: "f4", 2: "i4", 3: "i2", 4: "u2", 5: "u1"}
+
+# MAT level 5 data types
+miINT8 = 1
+miINT32 = 5
+miUINT32 = 6
+miMATRIX = 14
+miCOMPRESSED = 15
+mat5_dtypes = {1: "i1", 2: "u1", 3: "i2", 4: "u2", 5: "i4", 6: "u4", 7: "f4", 9: "f8", 12: "i8", 13: "u8"}
+mxDOUBLE_CLASS = 6
+
+
+def _find_mat4_matrix(fh, name):
+    # A level 4 file is a sequence of matrices, each one with a 20 bytes header
+    # (MOPT, mrows, ncols, imagf, namlen), the name and the column-major data
+    fh.seek(0, os.SEEK_END)
+    file_size = fh.tell()
+    pos = 0
+    while pos + 20 <= file_size:
+        fh.seek(pos)
+        header = fh.read(20)
+        for endian in "<>":
+            mopt, mrows, ncols, imagf, namlen = struct.unpack(endian + "5i", header)
+            if 0 <= mopt < 5000 and mopt // 1000 == (0 if endian == "<" else 1):
+                break
+        else:
+            return None
+
+        precision = (mopt // 10) % 10
+        matrix_type = mopt % 10
+        if precision not in mat4_dtypes or (mopt // 100) % 10 != 0:
+            return None
+        dtype = np.dtype(mat4_dtypes[precision]).newbyteorder(endian)
+
+        matrix_name = fh.read(namlen).rstrip(b"\x00").decode("latin1")
+        offset = pos + 20 + namlen
+        nbytes = mrows * ncols * dtype.itemsize * (2 if imagf else 1)
+        if matrix_name == name:
+            if matrix_type != 0 or imagf:
+                # text, sparse or complex matrices are not supported
+                return None
+            return dtype, offset, (mrows, ncols)
+        pos = offset + nbytes
+
+    return None
+
+
+def _read_mat5_tag(fh, endian):
+    data = fh.read(8)
+    if len(data) < 8:
+        return None, None, None
+    data_type, nbytes = struct.unpack(endian + "2I", data)
+    if data_type >> 16:
+        # Small data element format: type, size and data packed in 8 bytes
+        return data_type & 0xffff, data_type >> 16, data[4:4 + (data_type >> 16)]
+    return data_type, nbytes, None
+
+
+def _pad8(nbytes):
+    return nbytes + (-nbytes % 8)
+
+
+def _find_mat5_matrix(fh, name):
+    # A level 5 file has a 128 bytes header followed by tagged data elements
+    fh.seek(126)
+    endian = "<" if fh.read(2) == b"IM" else ">"
+
+    pos = 128
+    while True:
+        fh.seek(pos)
+        data_type, nbytes, _ = _read_mat5_tag(fh, endian)
+        if data_type is None:
+            return None
+        next_pos = pos + 8 + _pad8(nbytes)
+        if data_type != miMATRIX:
+            # e.g. miCOMPRESSED elements can not be mapped
+            pos = next_pos
+            continue
+
+        # Array flags
+        _, _, small = _read_mat5_tag(fh, endian)
+        flags = struct.unpack(endian + "2I", fh.read(8))[0]
+        mx_class = flags & 0xff
+        is_complex = flags & 0x0800
+
+        # Dimensions
+        _, dims_nbytes, small = _read_mat5_tag(fh, endian)
+        if small is None:
+            small = fh.read(_pad8(dims_nbytes))
+        dims = struct.unpack(endian + "%ii" % (dims_nbytes // 4), small[:dims_nbytes])
+
+        # Array name
+        _, name_nbytes, small = _read_mat5_tag(fh, endian)
+        if small is None:
+            small = fh.read(_pad8(name_nbytes))
+        matrix_name = small[:name_nbytes].decode("latin1")
+
+        if matrix_name != name:
+            pos = next_pos
+            continue
+        if mx_class != mxDOUBLE_CLASS or is_complex or len(dims) != 2:
+            return None
+
+        # Real part
+        data_type, nbytes, small = _read_mat5_tag(fh, endian)
+        if small is not None or data_type not in mat5_dtypes:
+            return None
+        dtype = np.dtype(mat5_dtypes[data_type]).newbyteorder(endian)
+        if dtype != np.dtype("f8"):
+            # values stored with a smaller type are upcast by loadmat
+            return None
+        return dtype, fh.tell(), tuple(dims)
+
+
+def find_mat_matrix(fname, name):
+    """
+    Locates a dense real matrix in a MAT level 4 file or in an uncompressed
+    MAT level 5 file. Returns (dtype, offset, shape) or None if the matrix can
+    not be mapped (e.g. compressed, sparse or complex).
+    """
+    with open(fname, "rb") as fh:
+        if fh.read(6) == b"MATLAB":
+            return _find_mat5_matrix(fh, name)
+        return _find_mat4_matrix(fh, name)
+
+
+def read_mat_matrix(fname, name):
+    """
+    Returns the matrix name stored in fname as a copy-on-write np.memmap
+    (column-major, as MATLAB stores it), so the data is not read until it is
+    accessed and its transpose is just a stride change. Matrices that can not
+    be mapped are loaded with scipy.io.loadmat.
+    """
+    info = find_mat_matrix(fname, name)
+    if info is None:
+        # scipy is only imported when it is needed
+        from scipy.io import loadmat
+        return loadmat(fname)[name]
+
+    dtype, offset, shape = info
+    if shape[0] * shape[1] == 0:
+        return np.zeros(shape, dtype=dtype, order="F")
+    return np.memmap(fname, dtype=dtype, mode="c", offset=offset, shape=shape, order="F")
@@ -0,0 +1,253 @@
+import numpy as np
+import xml.etree.ElementTree as ET
+
+__author__ = "Miguel Ponce de Leon"
+__copyright__ = "Copyright 2020, Tools for PhysiCell project"
+__credits__ = ["Miguel Ponce de Leon"]
+__license__ = "GNU"
+__version__ = "0.1.0"
+__maintainer__ = "Miguel Ponce de Leon"
+__email__ = "miguel.ponce@bsc.es"
+__status__ = "dev"
+
+
+# Rows of a BioFVM microenvironment matrix: voxel center, volume and then one
+# row per substrate (in the order of their IDs)
+voxel_rows = 4
+
+
+class Mesh(object):
+    """
+    Cartesian mesh of the microenvironment, given by the voxel center
+    coordinates along each axis. Fields are (nx, ny, nz) arrays indexed by
+    the voxel position along x, y and z.
+    """
+    def __init__(self, x, y, z, units=None, bounding_box=None):
+        self.x = np.asarray(x, dtype=float)
+        self.y = np.asarray(y, dtype=float)
+        self.z = np.asarray(z, dtype=float)
+        self.units = units
+        self.bounding_box = bounding_box
+
+    @property
+    def shape(self):
+        return (len(self.x), len(self.y), len(self.z))
+
+    @property
+    def size(self):
+        return len(self.x) * len(self.y) * len(self.z)
+
+    @property
+    def coordinates(self):
+        return (self.x, self.y, self.z)
+
+    def axis_index(self, axis, values):
+        # Position of each value in the coordinates of the axis (the nearest voxel center)
+        coords = self.coordinates[axis]
+        if len(coords) == 1:
+            return np.zeros(len(values), dtype=int)
+        i = np.searchsorted(coords, values)
+        i = np.clip(i, 1, len(coords) - 1)
+        i -= (values - coords[i-1]) < (coords[i] - values)
+        return i
+
+    def grid_index(self, centers):
+        """
+        Flat (C order) index in the (nx, ny, nz) grid of each voxel given by
+        the rows of centers (n x 3)
+        """
+        ijk = [self.axis_index(axis, centers[:, axis]) for axis in range(3)]
+        return np.ravel_multi_index(ijk, self.shape)
+
+    def _axis_interpolation(self, axis, values):
+        # Lower voxel and weight of the upper one of each value along an axis,
+        # values beyond the first and last voxel centers take their value
+        coords = self.coordinates[axis]
+        if len(coords) == 1:
+            return np.zeros(len(values), dtype=int), np.zeros(len(values))
+        i = np.clip(np.searchsorted(coords, values) - 1, 0, len(coords) - 2)
+        w = (values - coords[i]) / (coords[i+1] - coords[i])
+        return i, np.clip(w, 0., 1.)
+
+    def sample_points(self, points, method="nearest"):
+        """
+        Voxels and weights used to sample a field at the given (n x 3) points:
+        returns (n x k) arrays of grid indexes (see grid_index) and weights,
+        k being 1 for the "nearest" method and 8 for "trilinear"
+        """
+        points = np.asarray(points, dtype=float)
+        if method == "nearest":
+            ijk = [self.axis_index(axis, points[:, axis]) for axis in range(3)]
+            voxels = np.ravel_multi_index(ijk, self.shape)[:, None]
+            return voxels, np.ones(voxels.shape)
+        if method != "trilinear":
+            raise ValueError("Unknown sampling method: %s" % method)
+
+        lower, weights = zip(*[self._axis_interpolation(axis, points[:, axis]) for axis in range(3)])
+        voxels = np.empty((len(points), 8), dtype=int)
+        corner_weights = np.empty((len(points), 8))
+        for corner in range(8):
+            # Corner offsets along x, y and z given by the bits of corner
+            offsets = [(corner >> axis) & 1 for axis in range(3)]
+            ijk = [np.minimum(lower[axis] + offsets[axis], self.shape[axis] - 1) for axis in range(3)]
+            voxels[:, corner] = np.ravel_multi_index(ijk, self.shape)
+            w = np.ones(len(points))
+            for axis in range(3):
+                w *= weights[axis] if offsets[axis] else 1. - weights[axis]
+            corner_weights[:, corner] = w
+        return voxels, corner_weights
+
+    def meshgrid(self, indexing="xy"):
+        """ 2-D X, Y coordinate matrices of the xy plane (e.g. for contour plots) """
+        return np.meshgrid(self.x, self.y, indexing=indexing)
+
+
+def read_mesh(fname):
+    """
+    Reads the mesh of the microenvironment domain from a MultiCellDS XML
+    file. The parsing stops once the three coordinates lists have been read.
+    """
+    coordinates = {}
+    units = None
+    bounding_box = None
+    for event, elem in ET.iterparse(fname, events=("end",)):
+        tag = elem.tag
+        if tag in ("x_coordinates", "y_coordinates", "z_coordinates") and tag not in coordinates:
+            delimiter = elem.attrib.get("delimiter", " ")
+            coordinates[tag] = np.array(elem.text.split(delimiter), dtype=float)
+        elif tag == "bounding_box" and bounding_box is None:
+            bounding_box = np.array(elem.text.split(), dtype=float)
+        elif tag == "mesh":
+            units = elem.attrib.get("units")
+            break
+        else:
+            continue
+        elem.clear()
+
+    if len(coordinates) < 3:
+        raise ValueError("No microenvironment mesh found in %s" % fname)
+    return Mesh(coordinates["x_coordinates"], coordinates["y_coordinates"],
+                coordinates["z_coordinates"], units=units, bounding_box=bounding_box)
+
+
+class FieldLayout(object):
+    """
+    Maps the voxel columns of the microenvironment matrices to the (nx, ny, nz)
+    grid of the mesh. The index is computed once per run (voxels are stored in
+    the same order in every file). When the columns follow the BioFVM order
+    (x varying fastest) a field is just a Fortran order reshape of a row.
+    """
+    def __init__(self, mesh, centers):
+        self.mesh = mesh
+        index = mesh.grid_index(np.asarray(centers, dtype=float))
+        fortran_order = np.arange(mesh.size).reshape(mesh.shape, order="F").ravel()
+        if np.array_equal(index, fortran_order):
+            self.index = None
+        else:
+            self.index = index
+        # Inverse of index, built when first needed
+        self._columns = None
+
+    def voxel_columns(self, voxels):
+        """ Columns of the matrices holding the given grid indexes (see Mesh.grid_index) """
+        if self.index is None:
+            ijk = np.unravel_index(voxels, self.mesh.shape)
+            return np.ravel_multi_index(ijk, self.mesh.shape, order="F")
+        if self._columns is None:
+            self._columns = np.empty(self.mesh.size, dtype=int)
+            self._columns[self.index] = np.arange(self.mesh.size)
+        return self._columns[voxels]
+
+    def to_grid(self, values):
+        """ (nx, ny, nz) array of the values of a matrix row """
+        shape = self.mesh.shape
+        if self.index is None:
+            return np.array(np.reshape(values, shape, order="F"), order="K")
+        grid = np.empty(self.mesh.size, dtype=values.dtype)
+        grid[self.index] = values
+        return grid.reshape(shape)
+
+
+# Size of the blocks of time steps read at once by the cube reductions
+default_chunk_bytes = 64 * 1024**2
+
+
+class SubstrateCube(object):
+    """
+    (t, nx, ny, nz) concentrations of a substrate along a run, stored as a
+    .npy file and opened as a read-only memmap. Each time step is contiguous
+    on disk, and the reductions are computed over blocks of time steps so
+    that the cube is never loaded whole.
+    """
+    def __init__(self, fname, times, mesh=None, chunk_bytes=default_chunk_bytes):
+        self.fname = fname
+        self.data = np.load(fname, mmap_mode="r")
+        self.times = np.asarray(times)
+        self.mesh = mesh
+        frame_bytes = max(1, self.data[:1].nbytes)
+        self.chunk_size = max(1, int(chunk_bytes // frame_bytes))
+
+    @property
+    def shape(self):
+        return self.data.shape
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def chunks(self):
+        """ Yields (start, block) pairs, block holding the time steps start, start+1, ... """
+        for start in range(0, len(self.data), self.chunk_size):
+            yield start, np.asarray(self.data[start:start+self.chunk_size])
+
+    def reduce_space(self, func):
+        """
+        Applies func(block, axis=1) to the (steps x voxels) blocks of the cube,
+        returning one value per time step (e.g. func=np.mean)
+        """
+        values = np.empty(len(self.data))
+        for start, block in self.chunks():
+            block = block.reshape(len(block), -1)
+            values[start:start+len(block)] = func(block, axis=1)
+        return values
+
+    def reduce_time(self, ufunc):
+        """
+        Reduces the cube along time with a binary ufunc (e.g. np.add, np.minimum),
+        returning an (nx, ny, nz) field
+        """
+        result = None
+        for start, block in self.chunks():
+            partial = ufunc.reduce(block, axis=0)
+            result = partial if result is None else ufunc(result, partial)
+        return result
+
+    def space_mean(self):
+        return self.reduce_space(np.mean)
+
+    def space_min(self):
+        return self.reduce_space(np.min)
+
+    def space_max(self):
+        return self.reduce_space(np.max)
+
+    def time_mean(self):
+        return self.reduce_time(np.add) / len(self.data)
+
+    def time_min(self):
+        return self.reduce_time(np.minimum)
+
+    def time_max(self):
+        return self.reduce_time(np.maximum)
+
+    def fraction_below(self, threshold):
+        """
+        Fraction of the domain volume with a concentration below threshold at
+        each time step (e.g. the hypoxic fraction of oxygen). Voxels of the
+        BioFVM mesh have the same volume, so this is a fraction of voxels.
+        """
+        def fraction(block, axis):
+            return np.count_nonzero(block < threshold, axis=axis) / float(block.shape[axis])
+        return self.reduce_space(fraction)
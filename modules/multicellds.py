@@ -1,9 +1,21 @@
 import os
+import re
 import json
 import glob
-import pandas as pd
-from scipy.io import loadmat    
+import bisect
+import functools
+import collections
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import numpy as np
 import xml.etree.ElementTree as ET
+# pandas (and scipy, in matreader) are imported by the functions that use 
+# them so that importing this module is fast
+
+from matreader import read_mat_matrix, find_mat_matrix
+import physiboss
+import spatialindex
+import microenvironment
+import trajectories
 
 __author__ = "Miguel Ponce de Leon"
 __copyright__ = "Copyright 2020, Tools for PhysiCell project"
@@ -61,28 +73,161 @@ default_phase_grouping = {
 }
 
 
-class Metadata(object):
-    def __init__(self, tree):
-
-        root = tree.getroot()
-        metadata_node = root.findall("metadata")[0]
+class PhaseCounter(object):
+    """
+    Counts the number of cells of each phase group (e.g. live, apoptotic, necrotic)
+    using an integer lookup table from phase codes to groups and np.bincount.
+    Phase codes that are unknown or not grouped are not counted.
+    """
+    def __init__(self, phases_dict=default_phases_dict, phase_grouping=default_phase_grouping):
 
-        node = metadata_node.findall("current_time")[0]
-        self._current_time = int(float(node.text))
-        self._time_units = node.attrib['units']
+        # Groups in order of first appearance in phase_grouping
+        self._groups = list(dict.fromkeys(phase_grouping.values()))
+        group_index = {g: i for i, g in enumerate(self._groups)}
         
-        node = metadata_node.findall("current_runtime")[0]
-        self._current_runtime = float(node.text)
-        self._runtime_units = node.attrib['units']
-
-        micro_env_node = root.findall("microenvironment")[0]
-        node = micro_env_node.findall("domain")[0]
-        node = node.findall("mesh")[0]
-        self._spatial_units = node.attrib['units']
-    
+        # The extra last bin collects the phases that are not grouped
+        self._ungrouped = len(self._groups)
+        max_code = max(int(code) for code in phases_dict)
+        self._lut = np.full(max_code + 2, self._ungrouped, dtype=np.intp)
+        for code, phase_name in phases_dict.items():
+            group = phase_grouping.get(phase_name)
+            if group is not None:
+                self._lut[int(code)] = group_index[group]
+
+    @property
+    def groups(self):
+        return self._groups
+
+    def _group_codes(self, phases):
+        codes = np.asarray(phases).astype(np.intp, copy=False)
+        invalid = (codes < 0) | (codes >= len(self._lut))
+        if invalid.any():
+            codes = np.where(invalid, len(self._lut) - 1, codes)
+        return self._lut[codes]
+
+    def group_codes(self, phases):
+        """ Index of the group of each phase code, len(groups) for the phases not grouped """
+        return self._group_codes(phases)
+
+    def count(self, phases):
+        """ Number of cells in each group for an array of phase codes """
+        counts = np.bincount(self._group_codes(phases), minlength=self._ungrouped + 1)
+        return counts[:self._ungrouped]
+
+    def count_frames(self, phases_list):
+        """ 
+        Counts a batch of frames at once, returns a (frames x groups) array.
+        """
+        n_bins = self._ungrouped + 1
+        sizes = [len(p) for p in phases_list]
+        if sum(sizes) == 0:
+            return np.zeros((len(phases_list), self._ungrouped), dtype=np.intp)
+
+        groups = self._group_codes(np.concatenate(phases_list))
+        frame_offset = np.repeat(np.arange(len(phases_list)) * n_bins, sizes)
+        counts = np.bincount(frame_offset + groups, minlength=len(phases_list) * n_bins)
+        return counts.reshape(len(phases_list), n_bins)[:, :self._ungrouped]
+
+    def time_course(self, phases_iterator, batch_size=64):
+        """
+        Builds the time course table (time + one column per group) from an 
+        iterator of (time, phase codes array) tuples. Frames are counted
+        in batches of batch_size.
+        """
+        import pandas as pd
+
+        times = []
+        counts = []
+        batch = []
+        for time, phases in phases_iterator:
+            times.append(time)
+            batch.append(phases)
+            if len(batch) == batch_size:
+                counts.append(self.count_frames(batch))
+                batch = []
+        if batch:
+            counts.append(self.count_frames(batch))
+
+        if counts:
+            counts = np.concatenate(counts)
+        else:
+            counts = np.zeros((0, self._ungrouped), dtype=np.intp)
+
+        df = pd.DataFrame(counts, columns=self._groups)
+        df.insert(0, "time", np.array(times))
+        return df
+
+
+class XMLHeader(object):
+    """
+    Event-driven reader of the few nodes of a MultiCellDS output XML that are
+    required to load a snapshot (times, units, cell labels, variables and the
+    .mat filenames). Elements are cleared once they have been processed and 
+    the parsing stops as soon as all the nodes have been found, so the (large)
+    mesh coordinates lists are never kept in memory.
+    """
+    def __init__(self, fname):
+
+        self._current_time = None
+        self._time_units = None
+        self._current_runtime = None
+        self._runtime_units = None
+        self._spatial_units = None
+
+        self._cells_fname = None
+        self._microenvironment_fname = None
+        self._mesh_fname = None
+        self._labels = []
+        self._variables = []
+
+        self._parse(fname)
+
+    def _is_complete(self):
+        return (self._current_time is not None 
+                and self._current_runtime is not None
+                and self._cells_fname is not None)
+
+    def _parse(self, fname):
+        # Only the end events are handled: the small nodes we are interested in
+        # are read from their enclosing element once it has been fully parsed
+        for event, elem in ET.iterparse(fname, events=("end",)):
+            tag = elem.tag
+            if tag == "metadata":
+                node = elem.find("current_time")
+                self._current_time = float(node.text)
+                self._time_units = node.attrib.get('units')
+                node = elem.find("current_runtime")
+                self._current_runtime = float(node.text)
+                self._runtime_units = node.attrib.get('units')
+            elif tag == "domain":
+                node = elem.find("mesh")
+                if node is not None:
+                    self._spatial_units = node.attrib.get('units')
+                    self._mesh_fname = elem.findtext("mesh/voxels/filename")
+                self._microenvironment_fname = elem.findtext("data/filename")
+                for node in elem.iterfind("variables/variable"):
+                    a = node.attrib
+                    self._variables.append((a['name'], a['units'], a['ID']))
+            elif tag == "simplified_data":
+                # PhysiCell cell data, the BioFVM one is skipped
+                if elem.attrib.get("source") != "PhysiCell" or self._cells_fname is not None:
+                    elem.clear()
+                    continue
+                for node in elem.iterfind("labels/label"):
+                    self._labels.append((node.text, int(node.attrib["index"]), int(node.attrib["size"])))
+                self._cells_fname = elem.findtext("filename")
+            elif tag not in ("x_coordinates", "y_coordinates", "z_coordinates"):
+                # Any other node is kept until its enclosing element is processed,
+                # except for the mesh coordinates lists that are not needed
+                continue
+            
+            elem.clear()
+            if self._is_complete():
+                break
+
     @property
     def current_time(self):
-        return self._current_runtime
+        return self._current_time
 
     @property
     def time_units(self):
@@ -100,106 +245,377 @@ class Metadata(object):
     def spatial_units(self):
         return self._spatial_units
 
+    @property
+    def cells_fname(self):
+        return self._cells_fname
+
+    @property
+    def microenvironment_fname(self):
+        return self._microenvironment_fname
+
+    @property
+    def mesh_fname(self):
+        return self._mesh_fname
+
+    @property
+    def labels(self):
+        return self._labels
+
+    @property
+    def variables(self):
+        return self._variables
+
+
+class Snapshot(object):
+    """
+    Lightweight record with the information of an output*.xml file that is
+    needed to load a snapshot: its index, time and the .mat files it refers to.
+    """
+    def __init__(self, index, xml_fname, time, cells_fname, microenvironment_fname, mesh_fname,
+                 mtime=None, size=None):
+        self.index = index
+        self.xml_fname = xml_fname
+        self.time = time
+        self.cells_fname = cells_fname
+        self.microenvironment_fname = microenvironment_fname
+        self.mesh_fname = mesh_fname
+        # stat of the XML file when it was parsed, used to validate cached entries
+        self.mtime = mtime
+        self.size = size
+
+    def is_valid(self, stat):
+        return self.mtime == stat.st_mtime_ns and self.size == stat.st_size
+
+    def to_dict(self):
+        return {
+            "index": self.index,
+            "xml_fname": os.path.basename(self.xml_fname),
+            "time": self.time,
+            "cells_fname": self.cells_fname,
+            "microenvironment_fname": self.microenvironment_fname,
+            "mesh_fname": self.mesh_fname,
+            "mtime": self.mtime,
+            "size": self.size
+        }
+
+    @classmethod
+    def from_dict(cls, data, output_folder):
+        data = dict(data)
+        data["xml_fname"] = os.path.join(output_folder, data["xml_fname"])
+        return cls(**data)
+
+    def __repr__(self):
+        return "Snapshot(index=%i, time=%s, xml_fname=%s)" % (self.index, self.time, self.xml_fname)
+
+
+class CellsFormat(object):
+    """
+    Base class of the readers of each cells output format. A reader knows
+    the files of an output folder that form a snapshot, the labels of the 
+    cells columns and how to load the cells matrix of a snapshot.
+    Columns can be requested by their label, by the name of a vector label
+    (e.g. position) or by the format independent names in named_columns.
+    """
+    name = None
+    globing = None
+    index_cache_fname = None
+    store_folder_name = None
+
+    # Format independent column names, mapped to the column labels of the format
+    named_columns = {}
+
+    def __init__(self, output_folder):
+        self.output_folder = output_folder
+        self.metadata = None
+        self.cell_columns = []
+        self.vector_columns = {}
+        self.microenvironment_columns = []
+
+    @classmethod
+    def detect(cls, output_folder):
+        raise NotImplementedError
+
+    def read_snapshot(self, fname, stat):
+        raise NotImplementedError
+
+    def read_cells_matrix(self, fname, columns=None):
+        raise NotImplementedError
+
+    def count_cells(self, fname):
+        # Number of cells of a cells file, formats override it with a cheaper way
+        return self.read_cells_matrix(fname, columns=["ID"]).shape[0]
+
+    def _build_columns_index(self):
+        # Maps each column label (and each vector and named column) to
+        # its position(s) in the cells matrix
+        columns_index = {}
+        for i, column in enumerate(self.cell_columns):
+            columns_index[column] = [i]
+        for column, components in self.vector_columns.items():
+            if column not in columns_index:
+                columns_index[column] = [self.cell_columns.index(c) for c in components]
+        for name, column in self.named_columns.items():
+            if name not in columns_index and column in columns_index:
+                columns_index[name] = columns_index[column]
+        self._columns_index = columns_index
+
+    def get_columns_rows(self, columns):
+        """
+        Returns the labels and the positions in the cells matrix of the 
+        requested columns.
+        """
+        names = []
+        rows = []
+        for column in columns:
+            if column not in self._columns_index:
+                raise KeyError("Unknown cell column: %s" % column)
+            for i in self._columns_index[column]:
+                if i in rows:
+                    continue
+                names.append(self.cell_columns[i])
+                rows.append(i)
+        return names, rows
+
+
+class PhysiCellFormat(CellsFormat):
+    """
+    PhysiCell MultiCellDS output: one output*.xml file per snapshot pointing 
+    to a .mat file with the (columns x cells) matrix.
+    """
+    name = "physicell"
+    globing = "output*.xml"
+    index_cache_fname = ".multicellds_index.json"
+    store_folder_name = "cells_store"
+
+    named_columns = {"x": "x_position", "y": "y_position", "z": "z_position", 
+                     "phase": "current_phase", "volume": "total_volume"}
+
+    def __init__(self, output_folder, xml_fname="initial.xml", sep="_"):
+        CellsFormat.__init__(self, output_folder)
+        self._separator = sep
+
+        self.metadata = XMLHeader(os.path.join(output_folder, xml_fname))
+        for column, index, size in self.metadata.labels:
+            if size == 1:
+                self.cell_columns.append(column)
+                continue
+            components = [v + sep + column for v in ['x', 'y', 'z'][:size]]
+            self.cell_columns.extend(components)
+            self.vector_columns[column] = components
+        self.microenvironment_columns = list(self.metadata.variables)
+        self._build_columns_index()
+
+    @classmethod
+    def detect(cls, output_folder):
+        return len(glob.glob(os.path.join(output_folder, cls.globing))) > 0
+
+    def read_snapshot(self, fname, stat):
+        header = XMLHeader(fname)
+        basename = os.path.basename(fname)
+        index = int(re.sub(r"\D", "", basename) or 0)
+        snapshot = Snapshot(index, fname, 
+                            time=int(header.current_time), 
+                            cells_fname=header.cells_fname,
+                            microenvironment_fname=header.microenvironment_fname,
+                            mesh_fname=header.mesh_fname,
+                            mtime=stat.st_mtime_ns, size=stat.st_size)
+        return snapshot
+
+    def read_cells_matrix(self, fname, columns=None):
+        # Memory-mapped when possible, the data is only read when accessed
+        data = read_mat_matrix(fname, "cells")
+        if columns is not None:
+            names, rows = self.get_columns_rows(columns)
+            data = self._take_rows(data, rows)
+        # The transposed matrix is column-major: each column is contiguous
+        return data.T
+
+    def count_cells(self, fname):
+        # Read from the header of the matrix, the data is not accessed
+        info = find_mat_matrix(fname, "cells")
+        if info is None:
+            return super(PhysiCellFormat, self).count_cells(fname)
+        dtype, offset, shape = info
+        return shape[1]
+
+    def _take_rows(self, data, rows):
+        # Consecutive rows are taken as a view, otherwise only the 
+        # selected rows are copied
+        if len(rows) > 0 and rows == list(range(rows[0], rows[-1] + 1)):
+            return data[rows[0]:rows[-1] + 1]
+        return data[rows]
+
+
+class PhysiBoSSFormat(CellsFormat):
+    """
+    PhysiBoSS output: one cells_NNNNN.txt file (; separated) per snapshot.
+    """
+    name = "physiboss"
+    globing = physiboss.cells_file_globing
+    index_cache_fname = ".multicellds_index_physiboss.json"
+    store_folder_name = "cells_store_physiboss"
+
+    named_columns = {"cell_type": "cell_line", "volume": "volume_total",
+                     "nuclear_radius": "radius_nuclear"}
+
+    def __init__(self, output_folder, xml_fname="initial.xml", sep="_", file_sep=physiboss.default_separator):
+        CellsFormat.__init__(self, output_folder)
+        self._file_separator = file_sep
+
+        xml_fname = os.path.join(output_folder, xml_fname)
+        if os.path.exists(xml_fname):
+            self.metadata = XMLHeader(xml_fname)
+            self.microenvironment_columns = list(self.metadata.variables)
+
+        fnames = physiboss.cells_files(output_folder)
+        if fnames:
+            self.cell_columns = physiboss.read_header(fnames[0], sep=file_sep)
+        if all(c in self.cell_columns for c in "xyz"):
+            self.vector_columns["position"] = ["x", "y", "z"]
+        self._build_columns_index()
+
+    @classmethod
+    def detect(cls, output_folder):
+        return len(physiboss.cells_files(output_folder)) > 0
+
+    def read_snapshot(self, fname, stat):
+        basename = os.path.basename(fname)
+        index = int(re.sub(r"\D", "", basename) or 0)
+        
+        # The time is read from the first cell, if any
+        time = physiboss.file_time(fname)
+        with open(fname) as fh:
+            header = fh.readline().rstrip("\r\n").split(self._file_separator)
+            row = fh.readline()
+        if "Time" in header and row.strip():
+            time = float(row.split(self._file_separator)[header.index("Time")])
+
+        snapshot = Snapshot(index, fname, time=time, cells_fname=basename,
+                            microenvironment_fname=None, mesh_fname=None,
+                            mtime=stat.st_mtime_ns, size=stat.st_size)
+        return snapshot
+
+    def read_cells_matrix(self, fname, columns=None):
+        if columns is not None:
+            columns, rows = self.get_columns_rows(columns)
+        return physiboss.read_cells_matrix(fname, columns=columns, sep=self._file_separator)
+
+    def count_cells(self, fname):
+        return physiboss.count_cells(fname)
+
+
+# Available cells formats, in auto-detection order
+cells_formats = {
+    PhysiCellFormat.name: PhysiCellFormat,
+    PhysiBoSSFormat.name: PhysiBoSSFormat
+}
+
+
+def get_cells_format(output_folder, format=None, **kwargs):
+    """
+    Returns the reader of the cells format of output_folder. If format is
+    None the format is detected from the files found in the folder.
+    """
+    if format is None:
+        for cells_format in cells_formats.values():
+            if cells_format.detect(output_folder):
+                format = cells_format.name
+                break
+        else:
+            format = PhysiCellFormat.name
+    if format not in cells_formats:
+        raise ValueError("Unknown cells format: %s" % format)
+    return cells_formats[format](output_folder, **kwargs)
+
 
 class MultiCellDS(object):
+
+    index_cache_version = 1
+    store_version = 1
+    microenvironment_store_folder_name = "microenvironment_store"
     
-    def __init__(self, output_folder="./", xml_fname="initial.xml", sep="_"):
+    def __init__(self, output_folder="./", xml_fname="initial.xml", sep="_", use_cache=True, format=None):
         
         
         self._param_folder = os.path.join(os.path.dirname(__file__), "params")
-        self._globing = os.path.join(output_folder, "output*.xml")
         
         self._separator = sep
         self._output_folder = output_folder
+        self._xml_fname = os.path.join(output_folder, xml_fname)
 
         self._phases_dict = default_phases_dict
         self._phase_grouping = default_phase_grouping
 
-        xml_fname = os.path.join(output_folder, xml_fname)
-        self._tree = ET.parse(xml_fname)
+        # Reader of the cells output format (PhysiCell, PhysiBoSS), auto-detected if not given
+        self._format = get_cells_format(output_folder, format, xml_fname=xml_fname, sep=sep)
+        self._globing = os.path.join(output_folder, self._format.globing)
 
-        self._metadata = Metadata(self._tree)
-        self._cell_columns = self._get_cell_columns()
+        self._metadata = self._format.metadata
+        self._cell_columns = self._format.cell_columns
         self._microenvironment_columns = self._get_microenvironment_columns()
+        
+        # Microenvironment mesh and voxel layout, read once per run when needed
+        self._mesh = None
+        self._field_layout = None
+
+        # Snapshot index, built lazily the first time it is required.
+        # If use_cache is set, the index is also persisted in the output folder
+        self._snapshots = None
+        self._times = None
+        self._time_index = None
+        self._use_cache = use_cache
+        self.index_cache_fname = self._format.index_cache_fname
+        self._index_cache = os.path.join(output_folder, self.index_cache_fname)
+
+        # Consolidated cells store (see consolidate), used transparently if present
+        self.store_folder_name = self._format.store_folder_name
+        self._store_folder = os.path.join(output_folder, self.store_folder_name)
+        self._store = None
+        self._microenvironment_store_folder = os.path.join(output_folder, self.microenvironment_store_folder_name)
 
 
     def _get_time_units(self):
-        root = self._tree.getroot()
-        node = root.findall("metadata")[0]
-        node = node.findall("current_time")[0]
-        units = node.attrib['units']
-        return units
+        return self.time_units
 
-    def _get_cell_info_recursive(self, node):
+    def _get_header(self, xml_fname):
+        # xml_fname is either relative to the output folder or a full path
+        return XMLHeader(os.path.join(self._output_folder, xml_fname))
 
-        childs = [i for i in node]
-        if len(childs) == 0:
-            return None
-        for child in childs:
-            if child.tag != "simplified_data":
-                continue
-            if child.attrib["source"] == "PhysiCell":
-                return child
-    
-        return self._get_cell_info_recursive(childs[0])
-    
-    def _get_cell_columns(self):
-        root = self._tree.getroot()
-        node = root.findall("cellular_information")[0]
-        
-        node = self._get_cell_info_recursive(node)
-        cellular_info_node = node.findall("labels")[0]
-        
-        cell_columns = []
-        for child in cellular_info_node:
-            column = child.text
-            index = child.attrib["index"]
-            size = int(child.attrib["size"])
-            if size == 1:
-                cell_columns.append(column)
-                continue
-            for i, v in enumerate(['x', 'y', 'x']):
-                cell_columns.append(v + self._separator + column)
-                if i == size: 
-                    break
-                
-                
-        return cell_columns
+    def get_columns_rows(self, columns):
+        """
+        Returns the names and the row indexes in the cells matrix of the 
+        requested column labels.
+        """
+        return self._format.get_columns_rows(columns)
 
     def _get_microenvironment_columns(self):
-        root = self._tree.getroot()
-        node = root.findall("microenvironment")[0]
-        node = node.findall("domain")[0]
-        node = node.findall("variables")[0]
-        
-        columns = []
-        for child in node.findall("variable"):
-            name = child.attrib['name']
-            units = child.attrib['units']
-            ID = child.attrib['ID']
-            columns.append((name, units, ID))
-            
-        return columns
+        return list(self._format.microenvironment_columns)
+
+    # The metadata is not available for formats without XML output
 
     @property
     def current_time(self):
-        return self._metadata.current_runtime
+        return getattr(self._metadata, "current_runtime", None)
 
     @property
     def time_units(self):
-        return self._metadata.time_units
+        return getattr(self._metadata, "time_units", None)
     
     @property
     def current_runtime(self):
-        return self._metadata.current_runtime
+        return getattr(self._metadata, "current_runtime", None)
     
     @property
     def runtime_units(self):
-        return self._metadata.runtime_units
+        return getattr(self._metadata, "runtime_units", None)
     
     @property
     def spatial_units(self):
-        return self._metadata.spatial_units
+        return getattr(self._metadata, "spatial_units", None)
+
+    @property
+    def format(self):
+        return self._format.name
 
     @property
     def cell_columns(self):
@@ -217,140 +633,692 @@ class MultiCellDS(object):
     def phase_grouping(self):
         return self._phase_grouping
 
+    @property
+    def snapshots(self):
+        if self._snapshots is None:
+            self._build_snapshot_index()
+        return self._snapshots
+
+    def _read_snapshot(self, xml_fname, stat):
+        return self._format.read_snapshot(xml_fname, stat)
+
+    def _load_index_cache(self):
+        try:
+            with open(self._index_cache) as fh:
+                cache = json.load(fh)
+        except (OSError, ValueError):
+            return {}
+        
+        # The cache is discarded if it was written by a different version
+        # or if the layout of the output files has changed
+        if cache.get("version") != self.index_cache_version:
+            return {}
+        if cache.get("cell_columns") != self._cell_columns:
+            return {}
+        microenv_columns = [list(c) for c in self._microenvironment_columns]
+        if cache.get("microenvironment_columns") != microenv_columns:
+            return {}
+
+        snapshots = {}
+        for data in cache.get("snapshots", []):
+            snapshot = Snapshot.from_dict(data, self._output_folder)
+            snapshots[snapshot.xml_fname] = snapshot
+        return snapshots
+
+    def _save_index_cache(self):
+        cache = {
+            "version": self.index_cache_version,
+            "cell_columns": self._cell_columns,
+            "microenvironment_columns": [list(c) for c in self._microenvironment_columns],
+            "snapshots": [s.to_dict() for s in self._snapshots]
+        }
+        # Write to a temporary file first so that concurrent readers never see 
+        # a partial index. The cache is optional: a read-only folder is not an error.
+        tmp_fname = "%s.%i.tmp" % (self._index_cache, os.getpid())
+        try:
+            with open(tmp_fname, "w") as fh:
+                json.dump(cache, fh)
+            os.replace(tmp_fname, self._index_cache)
+        except OSError:
+            if os.path.exists(tmp_fname):
+                os.remove(tmp_fname)
+
+    def _build_snapshot_index(self):
+        # XML files already indexed (in memory or in the on-disk cache) and not
+        # modified since then are not parsed again
+        if self._snapshots is not None:
+            known = {s.xml_fname: s for s in self._snapshots}
+        elif self._use_cache:
+            known = self._load_index_cache()
+        else:
+            known = {}
+
+        updated = False
+        snapshots = []
+        for xml_fname in sorted(glob.glob(self._globing)):
+            stat = os.stat(xml_fname)
+            snapshot = known.pop(xml_fname, None)
+            if snapshot is None or not snapshot.is_valid(stat):
+                snapshot = self._read_snapshot(xml_fname, stat)
+                updated = True
+            snapshots.append(snapshot)
+        self._snapshots = snapshots
+
+        # time -> position lookup tables used by at_time
+        self._times = [s.time for s in snapshots]
+        self._time_index = {t: i for i, t in enumerate(self._times)}
+
+        # Entries left in known belong to files that no longer exist
+        if self._use_cache and (updated or known):
+            self._save_index_cache()
+
+    def refresh(self):
+        """
+        Update the snapshot index with the output files written since it was built 
+        (e.g. for a simulation that is still running).
+        """
+        self._build_snapshot_index()
+        return len(self._snapshots)
+
+    def __len__(self):
+        return len(self.snapshots)
+
+    def __getitem__(self, key):
+        """
+        Random access to the cells frames: mcds[i] returns the (time, DataFrame) 
+        pair of the i-th snapshot while mcds[start:stop:step] returns an iterator 
+        over the selected snapshots. Only the requested files are loaded.
+        """
+        if isinstance(key, slice):
+            return self._map_snapshots(self._cells_frame_item, self.snapshots[key])
+        return self.get_cells_frame(key)
+
+    def snapshot_index_at_time(self, time, exact=False):
+        """
+        Position of the snapshot saved at the given time. If exact is False 
+        the snapshot with the nearest time is returned.
+        """
+        snapshots = self.snapshots
+        if time in self._time_index:
+            return self._time_index[time]
+        if exact or len(snapshots) == 0:
+            raise KeyError("No snapshot found at time %s" % time)
+        
+        i = bisect.bisect_left(self._times, time)
+        if i == len(self._times):
+            return i - 1
+        if i > 0 and time - self._times[i-1] <= self._times[i] - time:
+            return i - 1
+        return i
+
+    def snapshots_after(self, time):
+        """
+        Snapshots saved after the given time, e.g. the ones not yet processed 
+        by an incremental analysis
+        """
+        snapshots = self.snapshots
+        return snapshots[bisect.bisect_right(self._times, time):]
+
+    def get_cells_frame(self, idx, columns=None):
+        snapshot = self.snapshots[idx]
+        return (snapshot.time, self._load_cells_frame(snapshot, columns=columns))
+
+    def at_time(self, time, exact=False, columns=None):
+        return self.get_cells_frame(self.snapshot_index_at_time(time, exact=exact), columns=columns)
+
+    def get_spatial_index(self, idx, radius_column=None):
+        """
+        Builds a spatialindex.SpatialIndex over the positions of the cells of
+        the idx-th snapshot, the cells keeping the order of get_cells_frame.
+        If radius_column is given the cells are treated as spheres.
+        """
+        columns = ["x", "y", "z"]
+        if radius_column is not None:
+            columns.append(radius_column)
+        cell_matrix = self._load_snapshot_cells(self.snapshots[idx], columns=columns)
+        radius = cell_matrix[:, 3] if radius_column is not None else None
+        return spatialindex.SpatialIndex(cell_matrix[:, :3], radius=radius)
+
+    def cells_in_region(self, idx, region, columns=None, radius_column=None):
+        """
+        Returns the (time, DataFrame) pair of the idx-th snapshot with only the 
+        cells inside region (a spatialindex Box, Sphere or HalfSpaces)
+        """
+        index = self.get_spatial_index(idx, radius_column=radius_column)
+        time, df = self.get_cells_frame(idx, columns=columns)
+        return (time, df.iloc[index.query(region)])
+
     def read_matlab_mat(self, fname, column):
-        stru = loadmat(fname)
-        data = stru[column]
+        # Memory-mapped when possible, the data is only read when accessed
+        data = read_mat_matrix(fname, column)
         return data
 
-    def get_time(self, tree):
-        root = tree.getroot()
-        node = root.findall("metadata")[0]
-        node = node.findall("current_time")[0]
-        time = int(float(node.text))
-        return time
+    def get_time(self, xml_fname):
+        return self._get_header(xml_fname).current_time
 
     def cells_file_count(self):
-        return len(glob.glob(self._globing))
+        return len(self.snapshots)
+
+    def get_cells_fname(self, xml_fname):
+        return self._get_header(xml_fname).cells_fname
 
-    def get_cells_fname(self, tree):
-        root = tree.getroot()
-        node = root.findall("cellular_information")[0]
-        node = self._get_cell_info_recursive(node)
-        node = node.findall("filename")[0]
-        return node.text
+    def get_cells_matrix(self, xml_fname, columns=None):
+        matfile = self.get_cells_fname(xml_fname)
+        return self._load_cells_matrix(matfile, columns=columns)
 
-    def get_cells_matrix(self, tree):
-        matfile = self.get_cells_fname(tree)
+    def _load_cells_matrix(self, matfile, columns=None):
         matfile = os.path.join(self._output_folder, matfile)
-        data = self.read_matlab_mat(matfile, "cells")
-        return data.T
+        return self._format.read_cells_matrix(matfile, columns=columns)
 
-    def cells_as_matrix_iterator(self):
-        xml_list = sorted(glob.glob(self._globing))
-        for xml_fname in xml_list:
-            tree = ET.parse(xml_fname)
-            cell_matrix = self.get_cells_matrix(tree)
-            
-            time = self.get_time(tree)
-            yield (time, cell_matrix)
-
-    def cells_as_frames_iterator(self):
-        xml_list = sorted(glob.glob(self._globing))
-        for xml_fname in xml_list:
-            tree = ET.parse(xml_fname)
-            cell_matrix = self.get_cells_matrix(tree)
-            
-            df = pd.DataFrame(cell_matrix, columns=self._cell_columns)
-            df = df.set_index("ID")
+    def _map_snapshots(self, func, snapshots, workers=None, processes=False, read_ahead=None):
+        """
+        Applies func to each snapshot and yields the results in time order. If 
+        workers > 1 the snapshots are loaded in a thread (or process) pool that 
+        is kept at most read_ahead snapshots ahead of the consumer.
+        """
+        if not workers or workers <= 1:
+            for snapshot in snapshots:
+                yield func(snapshot)
+            return
+
+        if read_ahead is None:
+            read_ahead = 2 * workers
+        read_ahead = max(read_ahead, workers)
+
+        Executor = ProcessPoolExecutor if processes else ThreadPoolExecutor
+        with Executor(max_workers=workers) as executor:
+            pending = collections.deque()
+            try:
+                for snapshot in snapshots:
+                    pending.append(executor.submit(func, snapshot))
+                    if len(pending) >= read_ahead:
+                        yield pending.popleft().result()
+                while pending:
+                    yield pending.popleft().result()
+            finally:
+                # The consumer may stop before the end, pending loads are discarded
+                for future in pending:
+                    future.cancel()
+
+    def _load_store_index(self):
+        fname = os.path.join(self._store_folder, "index.json")
+        try:
+            with open(fname) as fh:
+                store = json.load(fh)
+        except (OSError, ValueError):
+            return {}
+        if store.get("version") != self.store_version:
+            return {}
+        if store.get("cell_columns") != self._cell_columns:
+            return {}
+
+        partitions = {}
+        for entry in store["partitions"]:
+            snapshot = Snapshot.from_dict(entry["snapshot"], self._output_folder)
+            partitions[snapshot.xml_fname] = (snapshot, os.path.join(self._store_folder, entry["fname"]), entry)
+        return partitions
+
+    def _get_store_partition(self, snapshot):
+        # Partition of the consolidated store holding the snapshot cells, 
+        # only if the snapshot has not been modified since it was consolidated
+        if self._store is None:
+            self._store = self._load_store_index()
+        entry = self._store.get(snapshot.xml_fname)
+        if entry is None:
+            return None
+        stored, fname, _ = entry
+        if stored.mtime != snapshot.mtime or stored.size != snapshot.size:
+            return None
+        return fname
+
+    def _load_store_matrix(self, fname, columns=None):
+        names = self._cell_columns
+        if columns is not None:
+            names, rows = self.get_columns_rows(columns)
+        # Only the requested columns are read (and decompressed) from the partition
+        with np.load(fname) as data:
+            num_cells = data["ID"].shape[0]
+            cell_matrix = np.empty((num_cells, len(names)), order="F")
+            for j, name in enumerate(names):
+                cell_matrix[:, j] = data[name]
+        return cell_matrix
+
+    def _count_snapshot_cells(self, snapshot):
+        fname = self._get_store_partition(snapshot)
+        if fname is not None:
+            return self._store[snapshot.xml_fname][2]["num_cells"]
+        return self._format.count_cells(os.path.join(self._output_folder, snapshot.cells_fname))
+
+    def _load_snapshot_cells(self, snapshot, columns=None, copy=False):
+        fname = self._get_store_partition(snapshot)
+        if fname is not None:
+            return self._load_store_matrix(fname, columns=columns)
+        cell_matrix = self._load_cells_matrix(snapshot.cells_fname, columns=columns)
+        if copy and isinstance(cell_matrix, np.memmap):
+            # The memory map is only a view of the file, copying it reads the
+            # data here (e.g. in a pool worker) instead of in the consumer
+            cell_matrix = np.array(cell_matrix, order="F")
+        return cell_matrix
+
+    def _cells_matrix_item(self, snapshot, columns=None, copy=False):
+        return (snapshot.time, self._load_snapshot_cells(snapshot, columns=columns, copy=copy))
+
+    def cells_as_matrix_iterator(self, columns=None, workers=None, snapshots=None):
+        # snapshots restricts the iteration to a list of snapshots (e.g. from snapshots_after)
+        if snapshots is None:
+            snapshots = self.snapshots
+        # Frames loaded by a pool are read by the workers
+        copy = bool(workers and workers > 1)
+        func = functools.partial(self._cells_matrix_item, columns=columns, copy=copy)
+        return self._map_snapshots(func, snapshots, workers=workers)
+
+    def _load_cells_frame(self, snapshot, columns=None, copy=False):
+        import pandas as pd
+
+        names = self._cell_columns
+        if columns is not None:
+            # ID is always loaded as it is used as the index of the frame
+            names, rows = self.get_columns_rows(["ID"] + list(columns))
+        cell_matrix = self._load_snapshot_cells(snapshot, columns=names if columns is not None else None, copy=copy)
         
-            time = self.get_time(tree)
-            yield (time, df)
+        df = pd.DataFrame(cell_matrix, columns=names, copy=False)
+        df = df.set_index("ID")
+        return df
+
+    def _cells_frame_item(self, snapshot, columns=None, copy=False):
+        return (snapshot.time, self._load_cells_frame(snapshot, columns=columns, copy=copy))
+
+    def cells_as_frames_iterator(self, columns=None, workers=None, snapshots=None):
+        if snapshots is None:
+            snapshots = self.snapshots
+        copy = bool(workers and workers > 1)
+        func = functools.partial(self._cells_frame_item, columns=columns, copy=copy)
+        return self._map_snapshots(func, snapshots, workers=workers)
+
+    def _map_cells_item(self, snapshot, func=None, columns=None):
+        return (snapshot.time, func(self._load_snapshot_cells(snapshot, columns=columns)))
+
+    def map_cells(self, func, columns=None, workers=None, processes=False, snapshots=None, read_ahead=None):
+        """
+        Applies func to the cells matrix (with the given columns) of each snapshot
+        in the worker pool, so that both loading and func run in parallel. 
+        Yields (time, func(matrix)) in time order. With processes=True func must 
+        be picklable (e.g. a module level function or a functools.partial of one).
+        """
+        if snapshots is None:
+            snapshots = self.snapshots
+        item = functools.partial(self._map_cells_item, func=func, columns=columns)
+        return self._map_snapshots(item, snapshots, workers=workers, 
+                                   processes=processes, read_ahead=read_ahead)
+
+    def get_tracks(self, columns=("x", "y", "z", "phase"), workers=None, snapshots=None):
+        """
+        Follows the cells by ID along the snapshots and returns their tracks 
+        (a trajectories.Tracks) holding only the given columns, e.g. the 
+        positions for the MSD and the phase for the transitions.
+        """
+        # Labels are resolved to the matrix columns first: vector labels (e.g.
+        # position) are expanded to their components, and labels of the same 
+        # column (e.g. x and x_position) share it
+        names, rows = self.get_columns_rows(["ID"] + list(columns))
+        labels = []
+        for column in columns:
+            column_names, column_rows = self.get_columns_rows([column])
+            if len(column_names) == 1:
+                labels.append((column, column_names[0]))
+            else:
+                labels.extend(zip(column_names, column_names))
+
+        matrix_iterator = self.cells_as_matrix_iterator(columns=names, workers=workers, 
+                                                        snapshots=snapshots)
+        frames_iterator = ((t, m[:, 0], m[:, 1:]) for t, m in matrix_iterator)
+        tracks = trajectories.build_tracks(frames_iterator, names[1:])
+
+        values = {}
+        for label, name in labels:
+            if name == "ID":
+                values[label] = np.repeat(tracks.ids, tracks.lengths).astype(float)
+            else:
+                values[label] = tracks.values[name]
+        tracks.values = values
+        return tracks
+
+    def parallel_frames(self, workers=None, columns=None, processes=False, read_ahead=None):
+        """
+        Same as cells_as_frames_iterator but the frames are prefetched and decoded 
+        by a pool of workers (by default one per CPU). Frames are yielded in time
+        order and at most read_ahead frames are kept in memory ahead of the consumer.
+        Use processes=True when the per-frame work is dominated by Python code.
+        """
+        if workers is None:
+            workers = os.cpu_count() or 1
+        func = functools.partial(self._cells_frame_item, columns=columns, copy=workers > 1)
+        return self._map_snapshots(func, self.snapshots, workers=workers, 
+                                   processes=processes, read_ahead=read_ahead)
   
-    def get_microenvironment_fname(self, tree):
-        root = tree.getroot()
-        node = root.findall("microenvironment")[0]
-        node = node.findall("domain")[0]
-        node = node.findall("data")[0]
-        node = node.findall("filename")[0]
-        return node.text
-
-    def get_microenvironment_matrix(self, tree):
-        matfile = self.get_microenvironment_fname(tree)
+    def _consolidate_snapshot(self, snapshot, compress=True):
+        fname = "cells_%08i.npz" % snapshot.index
+        cell_matrix = self._load_cells_matrix(snapshot.cells_fname)
+        columns = {name: cell_matrix[:, j] for j, name in enumerate(self._cell_columns)}
+        
+        save = np.savez_compressed if compress else np.savez
+        save(os.path.join(self._store_folder, fname), **columns)
+        return {"fname": fname, "time": snapshot.time, "num_cells": cell_matrix.shape[0],
+                "snapshot": snapshot.to_dict()}
+
+    def consolidate(self, compress=True, workers=None):
+        """
+        Writes the cells of all the snapshots into a columnar store (one .npz 
+        partition per time, one array per column) in the output folder. Once it
+        exists, the cells iterators read from the store instead of the .mat files,
+        loading only the requested columns. Snapshots already consolidated and not
+        modified since then are not written again.
+        Returns the number of partitions written.
+        """
+        os.makedirs(self._store_folder, exist_ok=True)
+        
+        self._store = self._load_store_index()
+        partitions = []
+        pending = []
+        for snapshot in self.snapshots:
+            fname = self._get_store_partition(snapshot)
+            if fname is None:
+                pending.append(snapshot)
+                continue
+            partitions.append(self._store[snapshot.xml_fname][2])
+
+        func = functools.partial(self._consolidate_snapshot, compress=compress)
+        partitions.extend(self._map_snapshots(func, pending, workers=workers))
+        partitions.sort(key=lambda p: p["snapshot"]["xml_fname"])
+
+        store = {
+            "version": self.store_version,
+            "cell_columns": self._cell_columns,
+            "partitions": partitions
+        }
+        fname = os.path.join(self._store_folder, "index.json")
+        with open(fname + ".tmp", "w") as fh:
+            json.dump(store, fh)
+        os.replace(fname + ".tmp", fname)
+
+        self._store = None
+        return len(pending)
+
+    def get_microenvironment_fname(self, xml_fname):
+        return self._get_header(xml_fname).microenvironment_fname
+
+    def get_microenvironment_matrix(self, xml_fname):
+        matfile = self.get_microenvironment_fname(xml_fname)
+        return self._load_microenvironment_matrix(matfile)
+
+    def _load_microenvironment_matrix(self, matfile):
         matfile = os.path.join(self._output_folder, matfile)
         data = self.read_matlab_mat(matfile, "multiscale_microenvironment")
         return data
         
-    def microenvironment_as_matrix_iterator(self):
-        xml_list = sorted(glob.glob(self._globing))
-        for xml_fname in xml_list:
-            tree = ET.parse(xml_fname)
-            microenv_matrix = self.get_microenvironment_matrix(tree)
-            time = self.get_time(tree)
-            yield (time, microenv_matrix)
+    def _microenvironment_matrix_item(self, snapshot):
+        return (snapshot.time, self._load_microenvironment_matrix(snapshot.microenvironment_fname))
 
-    def full_cell_info_df(self, group_by_time=False):  # TODO: Could add an output_path_parameter?
+    def microenvironment_as_matrix_iterator(self, workers=None):
+        return self._map_snapshots(self._microenvironment_matrix_item, self.snapshots, workers=workers)
+
+    @property
+    def substrates(self):
+        return [str(name) for name, units, ID in self._microenvironment_columns]
+
+    @property
+    def mesh(self):
         """
-        Obtain a pandas.DataFrame that contains, for each cell, and at each PhysiCell full_data save timestep,
-        all "cellular_information" elements from the output XML files.
-            - The group_by_time option provides one row per timestep in the returned dataframe that includes the
-              mean for all cells for all cellular information. This is especially relevant for plotting purposes.
-        A .csv file with all the information is also stored within the PhysiBoSS/PhysiCell output folder.
+        microenvironment.Mesh of the run, parsed only once from the initial
+        (or the first) output XML file
         """
+        if self._mesh is None:
+            fname = self._xml_fname
+            if not os.path.exists(fname) and len(self.snapshots):
+                fname = self.snapshots[0].xml_fname
+            self._mesh = microenvironment.read_mesh(fname)
+        return self._mesh
 
-        output_path = self._output_folder
-        xml_list = sorted(glob.glob(self._globing))
-        total_rows = []
-        cols = self._cell_columns + ["Time (min)"]
+    def get_substrate_rows(self, substrates=None):
+        """
+        Returns the substrate names and their rows in the microenvironment matrix
+        """
+        rows = {str(name): microenvironment.voxel_rows + int(ID) 
+                for name, units, ID in self._microenvironment_columns}
+        if substrates is None:
+            substrates = self.substrates
+        elif isinstance(substrates, str):
+            substrates = [substrates]
+        for name in substrates:
+            if name not in rows:
+                raise KeyError("Unknown substrate: %s" % name)
+        return list(substrates), [rows[name] for name in substrates]
 
-        for xml_fname in xml_list:
-            tree = ET.parse(xml_fname)
-            cell_matrix = self.get_cells_matrix(tree)
-            time = round(self.get_time(tree), 2)  # If not rounded, provides int instead of float
+    def _get_field_layout(self, snapshot, data):
+        # Voxel centers from the mesh file (or from the first matrix read)
+        if self._field_layout is None:
+            centers = None
+            if snapshot.mesh_fname:
+                mesh_fname = os.path.join(self._output_folder, snapshot.mesh_fname)
+                if os.path.exists(mesh_fname):
+                    centers = self.read_matlab_mat(mesh_fname, "mesh")[:3, :].T
+            if centers is None:
+                centers = data[:3, :].T
+            self._field_layout = microenvironment.FieldLayout(self.mesh, centers)
+        return self._field_layout
 
-            list_elements = [element[0] for element in cell_matrix.T]
-            list_elements.append(time)
-            total_rows.append(list_elements)
+    def _load_substrate_fields(self, snapshot, substrates=None):
+        if not snapshot.microenvironment_fname:
+            raise ValueError("No microenvironment data for %s" % snapshot.xml_fname)
+        names, rows = self.get_substrate_rows(substrates)
+        matfile = os.path.join(self._output_folder, snapshot.microenvironment_fname)
+        # Memory-mapped matrix, only the rows of the requested substrates are read
+        data = self.read_matlab_mat(matfile, "multiscale_microenvironment")
+        layout = self._get_field_layout(snapshot, data)
+        return {name: layout.to_grid(data[row, :]) for name, row in zip(names, rows)}
 
-        df = pd.DataFrame(total_rows, columns=cols)
+    def get_substrate_fields(self, idx, substrates=None):
+        """
+        Returns the (time, fields) pair of the idx-th snapshot, fields being a 
+        dict of (nx, ny, nz) arrays (see mesh) with the concentrations of the 
+        given substrates (all of them by default).
+        """
+        snapshot = self.snapshots[idx]
+        return (snapshot.time, self._load_substrate_fields(snapshot, substrates=substrates))
 
-        if group_by_time == False:  # Returns full dataframe
-            df.to_csv(f"{output_path}/full_cell_info.csv", encoding="utf-8", header=True)
-            return df
+    def get_substrate_field(self, idx, substrate):
+        """ (nx, ny, nz) concentrations of a single substrate in the idx-th snapshot """
+        time, fields = self.get_substrate_fields(idx, substrates=[substrate])
+        return fields[substrate]
 
-        else:  # Returns a dataframe with mean of all parameters based on the time
-            df_grouped = df.groupby("Time (min)")
-            df_grouped = df_grouped.mean()
-            df_grouped.to_csv(f"{output_path}/full_cell_info_grouped_by_time.csv", encoding="utf-8", header=True)
-            return df_grouped
+    def _substrate_fields_item(self, snapshot, substrates=None):
+        return (snapshot.time, self._load_substrate_fields(snapshot, substrates=substrates))
 
-    def get_cells_summary_frame(self, phase_col="current_phase"):
+    def substrate_fields_iterator(self, substrates=None, workers=None, snapshots=None):
+        if snapshots is None:
+            snapshots = self.snapshots
+        # The layout is built before the pool so that workers share it
+        if len(snapshots) and self._field_layout is None:
+            self._load_substrate_fields(snapshots[0], substrates=[])
+        func = functools.partial(self._substrate_fields_item, substrates=substrates)
+        return self._map_snapshots(func, snapshots, workers=workers)
 
-        cell_phases = list(set(self.phase_grouping.values()))
-        num_of_files = self.cells_file_count()
+    def _sample_substrates(self, snapshot, substrates=None, method="nearest"):
+        if not snapshot.microenvironment_fname:
+            raise ValueError("No microenvironment data for %s" % snapshot.xml_fname)
+        names, rows = self.get_substrate_rows(substrates)
+        positions = self._load_snapshot_cells(snapshot, columns=["x", "y", "z"])
+        matfile = os.path.join(self._output_folder, snapshot.microenvironment_fname)
+        data = self.read_matlab_mat(matfile, "multiscale_microenvironment")
+        layout = self._get_field_layout(snapshot, data)
 
-        # Initializing a Pandas Dataframe to store the data
-        index = range(num_of_files)
-        columns = ["time"] + cell_phases
-        df_time_course = pd.DataFrame(columns=columns, dtype=int, index=index, data=0)
-        
-        for i, (time, df) in enumerate(self.cells_as_frames_iterator()):
-            df_time_course.iloc[i, 0] = time
+        # (cells x k) voxels and weights, mapped to the columns of the matrix
+        voxels, weights = self.mesh.sample_points(positions, method=method)
+        columns = layout.voxel_columns(voxels)
+        values = np.empty((len(positions), len(rows)))
+        for j, row in enumerate(rows):
+            field = np.asarray(data[row, :])
+            values[:, j] = (field[columns] * weights).sum(axis=1)
+        return (snapshot.time, values)
 
-            # Rename the phases integer codes using the phases_dict as the mapping
-            s = df[phase_col]
-            s.replace(to_replace=self.phases_dict, value=None, inplace=True)
+    def get_substrates_at_cells(self, idx, substrates=None, method="nearest"):
+        """
+        Returns the (time, values) pair of the idx-th snapshot, values being a 
+        (cells x substrates) array with the concentration of each substrate at 
+        the position of each cell, in the order of the cells matrix. method is 
+        "nearest" (value of the voxel holding the cell) or "trilinear".
+        """
+        return self._sample_substrates(self.snapshots[idx], substrates=substrates, method=method)
 
-            # Count the number of cells in each phase
-            counts = s.value_counts()
+    def substrates_at_cells_iterator(self, substrates=None, method="nearest", workers=None, snapshots=None):
+        if snapshots is None:
+            snapshots = self.snapshots
+        if len(snapshots) and self._field_layout is None:
+            self._load_substrate_fields(snapshots[0], substrates=[])
+        func = functools.partial(self._sample_substrates, substrates=substrates, method=method)
+        return self._map_snapshots(func, snapshots, workers=workers)
 
-            # group the previous phases count into the three general classes:
-            # Alive, Apoptotic, Necrotic
-            for k, v in counts.to_dict().items():
-                if k not in self.phase_grouping:
-                    continue
-                df_time_course.loc[i, self.phase_grouping[k]] += v
-        
-        return df_time_course
+    def _load_microenvironment_store_index(self):
+        fname = os.path.join(self._microenvironment_store_folder, "index.json")
+        try:
+            with open(fname) as fh:
+                store = json.load(fh)
+        except (OSError, ValueError):
+            return None
+        if store.get("version") != self.store_version:
+            return None
+        # The cubes are only valid for the snapshots they were written from
+        stored = [Snapshot.from_dict(s, self._output_folder) for s in store["snapshots"]]
+        current = self.snapshots
+        if len(stored) != len(current):
+            return None
+        for a, b in zip(stored, current):
+            if a.xml_fname != b.xml_fname or a.mtime != b.mtime or a.size != b.size:
+                return None
+        return store
+
+    def consolidate_microenvironment(self, substrates=None, workers=None):
+        """
+        Streams the microenvironment of all the snapshots into one (t, nx, ny, nz) 
+        cube per substrate (a .npy file in the microenvironment store folder), 
+        along with the time axis. Only a few frames are kept in memory while 
+        writing. Nothing is done if the store is up to date with the snapshots.
+        Returns the number of time steps written.
+        """
+        names, rows = self.get_substrate_rows(substrates)
+        store = self._load_microenvironment_store_index()
+        if store is not None and all(name in store["substrates"] for name in names):
+            return 0
+
+        folder = self._microenvironment_store_folder
+        os.makedirs(folder, exist_ok=True)
+        index_fname = os.path.join(folder, "index.json")
+        if os.path.exists(index_fname):
+            os.remove(index_fname)
+
+        snapshots = self.snapshots
+        shape = (len(snapshots),) + self.mesh.shape
+        cubes = {name: np.lib.format.open_memmap(os.path.join(folder, "%s.npy" % name), mode="w+",
+                                                 dtype=np.float64, shape=shape)
+                 for name in names}
+        times = []
+        for t, (time, fields) in enumerate(self.substrate_fields_iterator(substrates=names, workers=workers)):
+            for name in names:
+                cubes[name][t] = fields[name]
+            times.append(time)
+        for cube in cubes.values():
+            cube.flush()
+        del cubes
+
+        store = {
+            "version": self.store_version,
+            "substrates": names,
+            "shape": list(shape),
+            "times": times,
+            "snapshots": [snapshot.to_dict() for snapshot in snapshots]
+        }
+        with open(index_fname + ".tmp", "w") as fh:
+            json.dump(store, fh)
+        os.replace(index_fname + ".tmp", index_fname)
+        return len(times)
+
+    def get_substrate_cube(self, substrate, chunk_bytes=microenvironment.default_chunk_bytes):
+        """
+        Returns the microenvironment.SubstrateCube of a substrate written by 
+        consolidate_microenvironment
+        """
+        store = self._load_microenvironment_store_index()
+        if store is None or substrate not in store["substrates"]:
+            raise ValueError("No up to date cube of %s in %s, run consolidate_microenvironment first" 
+                             % (substrate, self._microenvironment_store_folder))
+        fname = os.path.join(self._microenvironment_store_folder, "%s.npy" % substrate)
+        return microenvironment.SubstrateCube(fname, store["times"], mesh=self.mesh, chunk_bytes=chunk_bytes)
+
+    def full_cell_info_df(self, group_by_time=False, columns=None, output_fname=None):
+        """
+        Obtain a pandas.DataFrame that contains, for each cell, and at each PhysiCell full_data save timestep,
+        all "cellular_information" elements from the output XML files (or only the given columns).
+            - The group_by_time option provides one row per timestep in the returned dataframe that includes the
+              mean for all cells for all cellular information. This is especially relevant for plotting purposes.
+            - If output_fname is given the dataframe is also stored: as a .csv file if it has the .csv 
+              extension, otherwise as a (much faster) pickle file.
+        """
+        import pandas as pd
+
+        time_column = "Time (min)"
+        names = self._cell_columns
+        if columns is not None:
+            names, rows = self.get_columns_rows(columns)
+
+        # The number of cells of each snapshot is read first (from the store
+        # index or the file headers), so that each frame is copied into a
+        # single preallocated array as soon as it is read, each snapshot being 
+        # a segment of consecutive rows. Frames (memory maps holding an open 
+        # file) are not kept once copied.
+        snapshots = self.snapshots
+        counts = np.array([self._count_snapshot_cells(s) for s in snapshots], dtype=np.intp)
+        offsets = np.zeros(len(counts) + 1, dtype=np.intp)
+        np.cumsum(counts, out=offsets[1:])
+        data = np.empty((offsets[-1], len(names) + 1), order="F")
+
+        times = []
+        for i, (time, cell_matrix) in enumerate(self.cells_as_matrix_iterator(columns=columns, snapshots=snapshots)):
+            if cell_matrix.shape[0] != counts[i]:
+                raise ValueError("%s changed while it was being read" % snapshots[i].xml_fname)
+            times.append(round(time, 2))  # If not rounded, provides int instead of float
+            data[offsets[i]:offsets[i+1], :-1] = cell_matrix
+            del cell_matrix
+        times = np.array(times, dtype=float)
+        data[:, -1] = np.repeat(times, counts)
+
+        if group_by_time == False:  # Returns full dataframe
+            df = pd.DataFrame(data, columns=names + [time_column], copy=False)
+
+        else:  # Returns a dataframe with mean of all parameters based on the time
+            nonempty = counts > 0
+            means = np.empty((nonempty.sum(), len(names)))
+            if nonempty.any():
+                sums = np.add.reduceat(data[:, :-1], offsets[:-1][nonempty], axis=0)
+                means = sums / counts[nonempty, np.newaxis]
+            index = pd.Index(times[nonempty], name=time_column)
+            df = pd.DataFrame(means, columns=names, index=index)
+
+        if output_fname is not None:
+            if output_fname.endswith(".csv"):
+                df.to_csv(output_fname, encoding="utf-8", header=True)
+            else:
+                df.to_pickle(output_fname)
+        return df
+
+    def get_cells_summary_frame(self, phase_col="phase", workers=None, snapshots=None):
+        """
+        Number of cells of each phase group (as defined by phase_grouping) at each time.
+        """
+        counter = PhaseCounter(self.phases_dict, self.phase_grouping)
+        matrix_iterator = self.cells_as_matrix_iterator(columns=[phase_col], workers=workers, 
+                                                        snapshots=snapshots)
+        phases_iterator = ((time, cell_matrix[:, 0]) for time, cell_matrix in matrix_iterator)
+        return counter.time_course(phases_iterator)
 
 
     def plot_cells(self):
@@ -0,0 +1,131 @@
+import os
+import re
+import glob
+import warnings
+import numpy as np
+
+__author__ = "Miguel Ponce de Leon"
+__copyright__ = "Copyright 2020, Tools for PhysiCell project"
+__credits__ = ["Miguel Ponce de Leon"]
+__license__ = "GNU"
+__version__ = "0.1.0"
+__maintainer__ = "Miguel Ponce de Leon"
+__email__ = "miguel.ponce@bsc.es"
+__status__ = "dev"
+
+
+# PhysiBoSS cell output files (e.g. cells_00120.txt), the number is the time
+cells_file_globing = "cells_[0-9]*.txt"
+default_separator = ";"
+
+# np.loadtxt is implemented in C since numpy 1.23. It is then the fastest
+# reader of these files (and parses the values exactly), the pandas C parser
+# is used with older numpy versions
+use_loadtxt = tuple(int(v) for v in re.findall(r"\d+", np.__version__)[:2]) >= (1, 23)
+
+
+def cells_files(data_folder):
+    globing = os.path.join(data_folder, cells_file_globing)
+    return sorted(glob.glob(globing))
+
+
+def file_time(fname):
+    return float(re.findall(r"\d+", os.path.basename(fname))[-1])
+
+
+def read_header(fname, sep=default_separator):
+    with open(fname) as fh:
+        header = fh.readline()
+    return header.rstrip("\r\n").split(sep)
+
+
+def count_cells(fname):
+    # Number of non empty lines after the header, the values are not parsed
+    with open(fname) as fh:
+        fh.readline()
+        return sum(1 for line in fh if line.strip())
+
+
+def _get_usecols(header, columns):
+    if columns is None:
+        return header
+    columns = list(columns)
+    for column in columns:
+        if column not in header:
+            raise KeyError("Unknown cell column: %s" % column)
+    return columns
+
+
+def _read_csv(fname, columns=None, sep=default_separator, chunksize=None):
+    # Every column is parsed as float64 by the C parser, the schema is taken
+    # from the header so that no type inference is needed
+    import pandas as pd
+
+    header = read_header(fname, sep=sep)
+    usecols = _get_usecols(header, columns)
+    dtype = {column: np.float64 for column in usecols}
+    reader = pd.read_csv(fname, sep=sep, usecols=usecols, dtype=dtype,
+                         engine="c", chunksize=chunksize)
+    return usecols, reader
+
+
+def _read_loadtxt(fname, columns=None, sep=default_separator):
+    header = read_header(fname, sep=sep)
+    usecols = _get_usecols(header, columns)
+    indexes = [header.index(column) for column in usecols]
+    with warnings.catch_warnings():
+        # Files with no cells only have the header
+        warnings.simplefilter("ignore", UserWarning)
+        data = np.loadtxt(fname, delimiter=sep, skiprows=1, usecols=indexes,
+                          dtype=np.float64, ndmin=2)
+    if data.size == 0:
+        data = np.zeros((0, len(usecols)))
+    return usecols, data
+
+
+def read_cells_frame(fname, columns=None, sep=default_separator):
+    """
+    Reads a PhysiBoSS cells file into a DataFrame. If columns is given only
+    those columns are parsed (in the given order).
+    """
+    if use_loadtxt:
+        import pandas as pd
+
+        usecols, data = _read_loadtxt(fname, columns=columns, sep=sep)
+        return pd.DataFrame(data, columns=usecols, copy=False)
+    usecols, df = _read_csv(fname, columns=columns, sep=sep)
+    return df[usecols]
+
+
+def read_cells_matrix(fname, columns=None, sep=default_separator):
+    """
+    Reads a PhysiBoSS cells file (or only the given columns) into a
+    (cells x columns) float matrix.
+    """
+    if use_loadtxt:
+        return _read_loadtxt(fname, columns=columns, sep=sep)[1]
+    return read_cells_frame(fname, columns=columns, sep=sep).to_numpy()
+
+
+def read_cells_chunks(fname, chunksize, columns=None, sep=default_separator):
+    """
+    Iterates over a large PhysiBoSS cells file in matrices of at most
+    chunksize cells.
+    """
+    usecols, reader = _read_csv(fname, columns=columns, sep=sep, chunksize=chunksize)
+    with reader:
+        for df in reader:
+            yield df[usecols].to_numpy()
+
+
+def cells_as_frames_iterator(data_folder, columns=None, sep=default_separator):
+    """
+    Yields a (time, DataFrame) tuple for each cells file in data_folder.
+    """
+    for fname in cells_files(data_folder):
+        df = read_cells_frame(fname, columns=columns, sep=sep)
+        if "Time" in df.columns and len(df) > 0:
+            time = df["Time"].iloc[0]
+        else:
+            time = file_time(fname)
+        yield (time, df)
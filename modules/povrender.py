@@ -0,0 +1,113 @@
+import os
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+__author__ = "Miguel Ponce de Leon"
+__copyright__ = "Copyright 2020, Tools for PhysiCell project"
+__credits__ = ["Miguel Ponce de Leon"]
+__license__ = "GNU"
+__version__ = "0.1.0"
+__maintainer__ = "Miguel Ponce de Leon"
+__email__ = "miguel.ponce@bsc.es"
+__status__ = "dev"
+
+
+# Status of a rendered frame
+DONE = "done"
+SKIPPED = "skipped"
+FAILED = "failed"
+
+
+def png_file_name(pov_fname):
+    return os.path.splitext(pov_fname)[0] + ".png"
+
+
+def is_up_to_date(target, *sources):
+    """
+    True if target exists and is newer than every existing source file
+    """
+    if not os.path.exists(target):
+        return False
+    mtime = os.stat(target).st_mtime_ns
+    for source in sources:
+        if os.path.exists(source) and os.stat(source).st_mtime_ns > mtime:
+            return False
+    return True
+
+
+class PovRenderer(object):
+    """
+    Runs a POV-Ray executable (or any program accepting the same command line,
+    e.g. a stub script for testing) to render a scene into a PNG image.
+    """
+    def __init__(self, executable="povray", width=720, height=680, antialias=True,
+                 render_threads=1, extra_args=()):
+        self.executable = executable
+        self.width = width
+        self.height = height
+        self.antialias = antialias
+        # POV-Ray work threads per render, one by default so that the number
+        # of concurrent renders is the number of cores used
+        self.render_threads = render_threads
+        self.extra_args = list(extra_args)
+
+    def command(self, pov_fname, png_fname):
+        # A pov_fname of "-" reads the scene from the standard input
+        cmd = [self.executable, "+I%s" % pov_fname, "+O%s" % png_fname, "+FN",
+               "+W%i" % self.width, "+H%i" % self.height, "-D", "-V"]
+        if self.antialias:
+            cmd.append("+A")
+        if self.render_threads:
+            cmd.append("+WT%i" % self.render_threads)
+        return cmd + self.extra_args
+
+    def render(self, pov_fname, png_fname, scene=None):
+        """
+        Renders pov_fname into png_fname. If scene (the text of the .pov file)
+        is given it is piped to the renderer and pov_fname is not read.
+        Returns a (success, message) tuple.
+        """
+        if scene is not None:
+            cmd = self.command("-", png_fname)
+            scene = scene.encode()
+        else:
+            cmd = self.command(pov_fname, png_fname)
+
+        try:
+            result = subprocess.run(cmd, input=scene, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        except OSError as e:
+            return False, str(e)
+
+        if result.returncode != 0:
+            message = result.stderr.decode(errors="replace").strip().splitlines()
+            message = message[-1] if message else "exit status %i" % result.returncode
+            return False, message
+        return True, ""
+
+
+def render_file(renderer, pov_fname, png_fname=None, force=False):
+    """
+    Renders a .pov file unless its PNG is already newer than it.
+    Returns a (pov_fname, status, message) tuple.
+    """
+    if png_fname is None:
+        png_fname = png_file_name(pov_fname)
+    if not force and is_up_to_date(png_fname, pov_fname):
+        return pov_fname, SKIPPED, ""
+    success, message = renderer.render(pov_fname, png_fname)
+    return pov_fname, DONE if success else FAILED, message
+
+
+def render_files(renderer, pov_fnames, workers=None, force=False):
+    """
+    Renders a list of .pov files running at most workers renderers at the
+    same time (one per core by default). Yields a (pov_fname, status, message)
+    tuple for each file, in the given order.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    # The work is done by the renderer processes, threads only wait for them
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(render_file, renderer, fname, force=force) for fname in pov_fnames]
+        for future in futures:
+            yield future.result()
@@ -0,0 +1,207 @@
+import numpy as np
+
+__author__ = "Miguel Ponce de Leon"
+__copyright__ = "Copyright 2020, Tools for PhysiCell project"
+__credits__ = ["Miguel Ponce de Leon"]
+__license__ = "GNU"
+__version__ = "0.1.0"
+__maintainer__ = "Miguel Ponce de Leon"
+__email__ = "miguel.ponce@bsc.es"
+__status__ = "dev"
+
+
+# Classification of a cell (a sphere) with respect to a region
+CULLED = 0
+VISIBLE = 1
+INTERSECTING = 2
+
+# Relative tolerance of the bin level decisions, cells closer than this to a
+# bin decision boundary are classified one by one
+_bin_tolerance = 1e-9
+
+
+def _combine(outside, inside):
+    modes = np.full(outside.shape, INTERSECTING, dtype=np.int8)
+    modes[inside] = VISIBLE
+    modes[outside] = CULLED
+    return modes
+
+
+class Box(object):
+    """
+    Axis aligned box between the corners lo and hi
+    """
+    def __init__(self, lo, hi):
+        self.lo = np.asarray(lo, dtype=float)
+        self.hi = np.asarray(hi, dtype=float)
+
+    def _distance(self, bmin, bmax):
+        # Distance from the points (or boxes between bmin and bmax) to the box
+        gap = np.maximum(np.maximum(self.lo - bmax, bmin - self.hi), 0)
+        return np.sqrt((gap**2).sum(axis=1))
+
+    def classify(self, centers, radius):
+        outside = self._distance(centers, centers) > radius
+        inside = np.all((self.lo + radius[:, None] <= centers) & (centers <= self.hi - radius[:, None]), axis=1)
+        return _combine(outside, inside)
+
+    def classify_boxes(self, bmin, bmax, rmax, tol):
+        outside = self._distance(bmin, bmax) > rmax + tol
+        inside = np.all((self.lo + (rmax + tol)[:, None] <= bmin) & (bmax <= self.hi - (rmax + tol)[:, None]), axis=1)
+        return _combine(outside, inside)
+
+
+class Sphere(object):
+    """
+    Sphere of the given center and radius
+    """
+    def __init__(self, center, radius):
+        self.center = np.asarray(center, dtype=float)
+        self.radius = float(radius)
+
+    def classify(self, centers, radius):
+        dist = np.sqrt(((centers - self.center)**2).sum(axis=1))
+        return _combine(dist - radius > self.radius, dist + radius <= self.radius)
+
+    def classify_boxes(self, bmin, bmax, rmax, tol):
+        nearest = np.clip(self.center, bmin, bmax)
+        min_dist = np.sqrt(((nearest - self.center)**2).sum(axis=1))
+        farthest = np.maximum(np.abs(bmin - self.center), np.abs(bmax - self.center))
+        max_dist = np.sqrt((farthest**2).sum(axis=1))
+        return _combine(min_dist - rmax - tol > self.radius, max_dist + rmax + tol <= self.radius)
+
+
+class HalfSpaces(object):
+    """
+    Region defined by planes given as (a, b, c, d) coefficients, the half-space
+    of a plane being a*x + b*y + c*z + d <= 0. If union is True the region is
+    the union of the half-spaces (as the clipping planes of povwriter),
+    otherwise it is their intersection.
+    """
+    def __init__(self, coefficients, union=True):
+        self.coefficients = np.asarray(coefficients, dtype=float).reshape(-1, 4)
+        self.union = union
+
+    def distances(self, centers):
+        # (cells x planes) signed distances, accumulated as d + a*x + b*y + c*z
+        dist = np.empty((len(centers), len(self.coefficients)))
+        dist[:] = self.coefficients[:, 3]
+        for i in range(3):
+            dist += centers[:, i:i+1] * self.coefficients[:, i]
+        return dist
+
+    def _reduce(self, outside, inside):
+        # outside and inside are (n x planes) relations to each plane
+        if len(self.coefficients) == 0:
+            return np.full(len(outside), VISIBLE, dtype=np.int8)
+        if self.union:
+            # A sphere crossing any of the planes is intersecting, as written by
+            # povwriter, even if another half-space holds it completely
+            intersecting = (~outside & ~inside).any(axis=1)
+            return _combine(outside.all(axis=1), inside.any(axis=1) & ~intersecting)
+        return _combine(outside.any(axis=1), inside.all(axis=1))
+
+    def classify(self, centers, radius):
+        dist = self.distances(centers)
+        radius = radius[:, None]
+        return self._reduce(dist > radius, dist <= -radius)
+
+    def classify_boxes(self, bmin, bmax, rmax, tol):
+        center = (bmin + bmax) / 2
+        extent = (bmax - bmin) / 2
+        dist = self.distances(center)
+        spread = extent.dot(np.abs(self.coefficients[:, :3]).T)
+        margin = (rmax + tol)[:, None]
+        return self._reduce(dist - spread > margin, dist + spread <= -margin)
+
+
+class SpatialIndex(object):
+    """
+    Uniform grid over the cell positions of a snapshot. Cells are sorted by
+    grid bin so that each bin is a contiguous range, and regions are first
+    tested against the bounding box of the cells of each bin: only the cells
+    of the bins crossing the boundary of the region are tested one by one.
+    """
+    def __init__(self, positions, radius=None, cells_per_bin=64):
+        self.positions = np.asarray(positions, dtype=float)
+        num_cells = len(self.positions)
+        if radius is None:
+            radius = np.zeros(num_cells)
+        self.radius = np.asarray(radius, dtype=float)
+
+        if num_cells:
+            lo = self.positions.min(axis=0)
+            hi = self.positions.max(axis=0)
+        else:
+            lo = hi = np.zeros(3)
+        num_bins = max(1, int(np.ceil((num_cells / float(cells_per_bin))**(1./3.))))
+        self.origin = lo
+        self.bin_size = np.maximum((hi - lo) / num_bins, 1e-12)
+        self.shape = (num_bins,) * 3
+
+        ijk = ((self.positions - lo) / self.bin_size).astype(int)
+        ijk = np.clip(ijk, 0, num_bins - 1)
+        keys = np.ravel_multi_index(ijk.T, self.shape)
+        self.order = np.argsort(keys, kind="stable")
+
+        # Ranges of the non empty bins in the sorted cells
+        keys = keys[self.order]
+        self.starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]]) if num_cells else np.zeros(0, dtype=int)
+        self.stops = np.r_[self.starts[1:], num_cells].astype(int)
+
+        sorted_positions = self.positions[self.order]
+        if num_cells:
+            self.bin_min = np.minimum.reduceat(sorted_positions, self.starts, axis=0)
+            self.bin_max = np.maximum.reduceat(sorted_positions, self.starts, axis=0)
+        else:
+            self.bin_min = self.bin_max = np.zeros((0, 3))
+        scale = np.abs(sorted_positions).max() if num_cells else 1.
+        self._tolerance = _bin_tolerance * max(scale, 1.)
+
+    def __len__(self):
+        return len(self.positions)
+
+    def classify(self, region, radius=None):
+        """
+        Classifies every cell as CULLED, VISIBLE (completely inside the region)
+        or INTERSECTING the boundary of the region. radius overrides the radius
+        given when the index was built. Returns the array of classes in the
+        original order of the cells.
+        """
+        radius = self.radius if radius is None else np.asarray(radius, dtype=float)
+        sorted_radius = radius[self.order]
+        num_cells = len(self.positions)
+        modes = np.empty(num_cells, dtype=np.int8)
+        if num_cells == 0:
+            return modes
+
+        rmax = np.maximum.reduceat(sorted_radius, self.starts)
+        tol = np.full(len(rmax), self._tolerance)
+        bin_modes = region.classify_boxes(self.bin_min, self.bin_max, rmax, tol)
+
+        # Bins with a decided class
+        sizes = self.stops - self.starts
+        sorted_modes = np.repeat(bin_modes, sizes)
+
+        # Bins crossing the boundary, their cells are classified one by one
+        undecided = np.repeat(bin_modes == INTERSECTING, sizes)
+        cells = self.order[undecided]
+        sorted_modes[undecided] = region.classify(self.positions[cells], radius[cells])
+
+        modes[self.order] = sorted_modes
+        return modes
+
+    def query(self, region, radius=None):
+        """
+        Sorted indexes of the cells that are (at least partly) inside the region
+        """
+        return np.flatnonzero(self.classify(region, radius=radius) != CULLED)
+
+    def in_box(self, lo, hi, radius=None):
+        return self.query(Box(lo, hi), radius=radius)
+
+    def in_sphere(self, center, sphere_radius, radius=None):
+        return self.query(Sphere(center, sphere_radius), radius=radius)
+
+    def in_halfspaces(self, coefficients, union=False, radius=None):
+        return self.query(HalfSpaces(coefficients, union=union), radius=radius)
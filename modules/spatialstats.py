@@ -0,0 +1,141 @@
+import numpy as np
+
+__author__ = "Miguel Ponce de Leon"
+__copyright__ = "Copyright 2020, Tools for PhysiCell project"
+__credits__ = ["Miguel Ponce de Leon"]
+__license__ = "GNU"
+__version__ = "0.1.0"
+__maintainer__ = "Miguel Ponce de Leon"
+__email__ = "miguel.ponce@bsc.es"
+__status__ = "dev"
+
+# scipy.spatial is imported by Neighbours, so that importing this module is fast
+
+
+def center_of_mass(positions, weights=None):
+    positions = np.asarray(positions, dtype=float)
+    if len(positions) == 0:
+        return np.zeros(positions.shape[1])
+    return np.average(positions, axis=0, weights=weights)
+
+
+class Neighbours(object):
+    """
+    k-d tree over the positions of the cells of a snapshot, built once and
+    shared by the neighbour queries. radius (the cell radii) is only needed
+    for the contact queries.
+    """
+    def __init__(self, positions, radius=None):
+        from scipy.spatial import cKDTree
+
+        self.positions = np.asarray(positions, dtype=float)
+        self.radius = None if radius is None else np.asarray(radius, dtype=float)
+        self.tree = cKDTree(self.positions)
+
+    def __len__(self):
+        return len(self.positions)
+
+    def counts(self, distance):
+        """ Number of other cells closer than distance to each cell """
+        if len(self.positions) == 0:
+            return np.zeros(0, dtype=int)
+        counts = self.tree.query_ball_point(self.positions, distance, return_length=True)
+        return np.asarray(counts) - 1
+
+    def local_density(self, distance):
+        """ Cells per unit volume in the sphere of the given radius around each cell """
+        return (self.counts(distance) + 1) / (4. / 3. * np.pi * distance**3)
+
+    def pairs(self, distance):
+        """ (n x 2) array of the pairs of cells closer than distance """
+        return self.tree.query_pairs(distance, output_type="ndarray")
+
+    def contact_pairs(self, tolerance=0.):
+        """ (n x 2) array of the pairs of cells whose spheres overlap (or are closer than tolerance) """
+        if self.radius is None:
+            raise ValueError("The cell radius is required for the contact queries")
+        if len(self.positions) < 2:
+            return np.zeros((0, 2), dtype=int)
+        # Candidates are found with the largest radius, then filtered pair by pair
+        pairs = self.pairs(2 * self.radius.max() + tolerance)
+        d = self.positions[pairs[:, 0]] - self.positions[pairs[:, 1]]
+        dist = np.sqrt((d**2).sum(axis=1))
+        return pairs[dist <= self.radius[pairs[:, 0]] + self.radius[pairs[:, 1]] + tolerance]
+
+    def contacts(self, tolerance=0.):
+        """ Number of cells in contact with each cell """
+        pairs = self.contact_pairs(tolerance=tolerance)
+        return np.bincount(pairs.ravel(), minlength=len(self.positions))
+
+
+def radial_distances(positions, center=None):
+    positions = np.asarray(positions, dtype=float)
+    if center is None:
+        center = center_of_mass(positions)
+    return np.sqrt(((positions - center)**2).sum(axis=1))
+
+
+def _radial_bins(distances, bins):
+    # bins is either the bin width or the array of bin edges
+    if np.ndim(bins) == 0:
+        num_bins = int(np.floor(distances.max() / bins)) + 1 if len(distances) else 1
+        edges = np.arange(num_bins + 1) * float(bins)
+    else:
+        edges = np.asarray(bins, dtype=float)
+    # Distances beyond the last edge are left out (bin -1 or num_bins)
+    idx = np.searchsorted(edges, distances, side="right") - 1
+    idx[distances == edges[-1]] = len(edges) - 2
+    return edges, idx
+
+
+def radial_profile(positions, values, bins, center=None):
+    """
+    Mean of the values (a column, or a cells x columns matrix) of the cells
+    in shells around center (the center of mass by default). bins is the
+    width of the shells or the array of their edges.
+    Returns (edges, counts, means), means being nan in empty shells.
+    """
+    distances = radial_distances(positions, center=center)
+    edges, idx = _radial_bins(distances, bins)
+    num_bins = len(edges) - 1
+    valid = (idx >= 0) & (idx < num_bins)
+    idx = idx[valid]
+    values = np.asarray(values, dtype=float)[valid]
+
+    counts = np.bincount(idx, minlength=num_bins)
+    if values.ndim == 1:
+        sums = np.bincount(idx, weights=values, minlength=num_bins)
+    else:
+        sums = np.stack([np.bincount(idx, weights=values[:, j], minlength=num_bins)
+                         for j in range(values.shape[1])], axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = sums / (counts if sums.ndim == 1 else counts[:, None])
+    return edges, counts, means
+
+
+def radial_counts(positions, labels, bins, num_labels=None, center=None):
+    """
+    Number of cells of each label (e.g. the phase groups given by a
+    PhaseCounter lookup table) in shells around center.
+    Returns (edges, counts), counts being a (shells x labels) array.
+    """
+    distances = radial_distances(positions, center=center)
+    edges, idx = _radial_bins(distances, bins)
+    num_bins = len(edges) - 1
+    labels = np.asarray(labels).astype(int)
+    if num_labels is None:
+        num_labels = labels.max() + 1 if len(labels) else 0
+    valid = (idx >= 0) & (idx < num_bins) & (labels >= 0) & (labels < num_labels)
+    counts = np.bincount(idx[valid] * num_labels + labels[valid], minlength=num_bins * num_labels)
+    return edges, counts.reshape(num_bins, num_labels)
+
+
+def density_map(positions, bins, range=None, axes=(0, 1), weights=None):
+    """
+    Histogram of the cells over the given axes (two for a 2-D map, three
+    for a 3-D one). bins and range are given as in numpy.histogramdd, e.g.
+    the same range for every snapshot of a run keeps the maps comparable.
+    Returns (counts, edges).
+    """
+    positions = np.asarray(positions, dtype=float)[:, list(axes)]
+    return np.histogramdd(positions, bins=bins, range=range, weights=weights)
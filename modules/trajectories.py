@@ -0,0 +1,198 @@
+import numpy as np
+
+__author__ = "Miguel Ponce de Leon"
+__copyright__ = "Copyright 2020, Tools for PhysiCell project"
+__credits__ = ["Miguel Ponce de Leon"]
+__license__ = "GNU"
+__version__ = "0.1.0"
+__maintainer__ = "Miguel Ponce de Leon"
+__email__ = "miguel.ponce@bsc.es"
+__status__ = "dev"
+
+
+class Tracks(object):
+    """
+    Tracks of the cells along a run, stored as ragged columns: the rows of
+    track i (one per snapshot in which the cell is present, in time order)
+    are offsets[i]:offsets[i+1] of frames and of each values column. Tracks
+    are sorted by cell ID.
+    """
+    def __init__(self, ids, offsets, frames, times, values, new_cells=None, lost_cells=None):
+        self.ids = ids
+        self.offsets = offsets
+        self.frames = frames
+        self.times = np.asarray(times)
+        self.values = values
+        # Number of IDs that appear in (or are missing from) each snapshot with
+        # respect to the previous one, e.g. divisions and deaths
+        self.new_cells = new_cells
+        self.lost_cells = lost_cells
+        self._track_of_row = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def columns(self):
+        return list(self.values)
+
+    @property
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    @property
+    def track_of_row(self):
+        # Track index of each row
+        if self._track_of_row is None:
+            self._track_of_row = np.repeat(np.arange(len(self.ids)), self.lengths)
+        return self._track_of_row
+
+    def track(self, cell_id):
+        """ Dict with the times and the column values of the track of a cell """
+        i = np.searchsorted(self.ids, cell_id)
+        if i == len(self.ids) or self.ids[i] != cell_id:
+            raise KeyError("No track for the cell ID %s" % cell_id)
+        rows = slice(self.offsets[i], self.offsets[i+1])
+        track = {"time": self.times[self.frames[rows]]}
+        track.update((name, column[rows]) for name, column in self.values.items())
+        return track
+
+    @property
+    def first_time(self):
+        return self.times[self.frames[self.offsets[:-1]]]
+
+    @property
+    def last_time(self):
+        return self.times[self.frames[self.offsets[1:] - 1]]
+
+    def lifetime(self):
+        """ Time between the first and the last snapshot of each track """
+        return self.last_time - self.first_time
+
+    def ended(self):
+        """ True for the tracks whose cell is missing from the last snapshot """
+        return self.frames[self.offsets[1:] - 1] < len(self.times) - 1
+
+    def first_time_in(self, column, codes):
+        """
+        Time of the first snapshot in which the column takes one of the codes
+        (e.g. the phase codes of the dead cells), nan if it never does
+        """
+        hit = np.isin(self.values[column], codes)
+        times = np.where(hit, self.times[self.frames], np.inf)
+        first = np.minimum.reduceat(times, self.offsets[:-1]) if len(self.ids) else times
+        first[np.isinf(first)] = np.nan
+        return first
+
+    def transitions(self, column="phase"):
+        """
+        Changes of the column between consecutive snapshots of the same track.
+        Returns (pairs, counts): the distinct (from, to) values and how many
+        times each transition happens.
+        """
+        values = self.values[column]
+        same_track = self.track_of_row[1:] == self.track_of_row[:-1]
+        changed = same_track & (values[1:] != values[:-1])
+        pairs = np.stack([values[:-1][changed], values[1:][changed]], axis=1)
+        if len(pairs) == 0:
+            return pairs, np.zeros(0, dtype=int)
+        return np.unique(pairs, axis=0, return_counts=True)
+
+    def _positions(self, columns):
+        return np.stack([self.values[c] for c in columns], axis=1)
+
+    def displacements(self, columns=("x", "y", "z")):
+        """ Distance of each row to the first position of its track """
+        positions = self._positions(columns)
+        start = positions[self.offsets[:-1]]
+        return np.sqrt(((positions - np.repeat(start, self.lengths, axis=0))**2).sum(axis=1))
+
+    def speeds(self, columns=("x", "y", "z")):
+        """ Speed of each row since the previous snapshot of its track, nan in the first row """
+        positions = self._positions(columns)
+        times = self.times[self.frames]
+        step = np.sqrt(((positions[1:] - positions[:-1])**2).sum(axis=1))
+        speeds = np.full(len(positions), np.nan)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            speeds[1:] = step / (times[1:] - times[:-1])
+        speeds[self.offsets[:-1]] = np.nan
+        return speeds
+
+    def msd(self, max_lag=None, columns=("x", "y", "z")):
+        """
+        Mean squared displacement over all the tracks for lags of 1 to max_lag
+        snapshots. Returns (lags, msd, counts), counts being the number of
+        displacements averaged for each lag.
+        """
+        if max_lag is None:
+            max_lag = len(self.times) - 1
+        lags = np.arange(1, max_lag + 1)
+        msd = np.full(len(lags), np.nan)
+        counts = np.zeros(len(lags), dtype=int)
+        # Rows lag snapshots apart in the same track are the ones whose keys
+        # differ by lag (rows of different tracks differ by more than the
+        # number of snapshots)
+        key = self.track_of_row * (2 * len(self.times)) + self.frames
+        for k, lag in enumerate(lags):
+            if lag >= len(self.frames):
+                break
+            # The squared displacements are computed on whole columns and then masked
+            valid = (key[lag:] - key[:-lag]) == lag
+            counts[k] = np.count_nonzero(valid)
+            if counts[k] == 0:
+                continue
+            squared = np.zeros(len(valid))
+            for c in columns:
+                d = self.values[c][lag:] - self.values[c][:-lag]
+                squared += d * d
+            msd[k] = np.sum(squared, where=valid) / counts[k]
+        return lags, msd, counts
+
+
+def build_tracks(frames_iterator, columns):
+    """
+    Builds the Tracks of an iterator of (time, ids, matrix) tuples, the
+    matrix columns being named by columns. Consecutive snapshots are aligned
+    on the sorted IDs to count the new and lost cells, and the rows are
+    grouped by ID with a single stable sort at the end.
+    """
+    times = []
+    ids_list = []
+    values_list = []
+    new_cells = []
+    lost_cells = []
+    previous = np.zeros(0, dtype=np.int64)
+    for frame, (time, ids, matrix) in enumerate(frames_iterator):
+        ids = np.asarray(ids).astype(np.int64)
+        order = np.argsort(ids, kind="stable")
+        ids = ids[order]
+        common = np.intersect1d(previous, ids, assume_unique=True)
+        new_cells.append(len(ids) - len(common))
+        lost_cells.append(len(previous) - len(common))
+        previous = ids
+
+        times.append(time)
+        ids_list.append(ids)
+        values_list.append(np.asarray(matrix)[order])
+
+    if times:
+        sizes = [len(ids) for ids in ids_list]
+        all_ids = np.concatenate(ids_list)
+        frames = np.repeat(np.arange(len(times), dtype=np.int32), sizes)
+        matrix = np.concatenate(values_list)
+    else:
+        all_ids = np.zeros(0, dtype=np.int64)
+        frames = np.zeros(0, dtype=np.int32)
+        matrix = np.zeros((0, len(columns)))
+    del ids_list, values_list
+
+    # Frames are in time order, so the stable sort keeps each track in time order
+    order = np.argsort(all_ids, kind="stable")
+    all_ids = all_ids[order]
+    frames = frames[order]
+    starts = np.flatnonzero(np.r_[True, all_ids[1:] != all_ids[:-1]]) if len(all_ids) else np.zeros(0, dtype=int)
+    offsets = np.r_[starts, len(all_ids)].astype(np.int64)
+    values = {name: matrix[order, j] for j, name in enumerate(columns)}
+
+    return Tracks(all_ids[starts], offsets, frames, times, values,
+                  new_cells=np.array(new_cells), lost_cells=np.array(lost_cells))
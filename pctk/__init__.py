@@ -0,0 +1,62 @@
+"""
+Importable API of the Tools for PhysiCell project:
+
+    import pctk
+    mcds = pctk.MultiCellDS(output_folder="output")
+    pctk.plot_time_course.main(["output", "--no-figure", "--csvout", "time_course.csv"])
+
+The library modules (multicellds, physiboss, ...) and the scripts 
+(plot_time_course, povwriter, consolidate) are imported the first time they
+are accessed, so importing pctk is fast.
+"""
+import os
+import sys
+import importlib
+
+__author__ = "Miguel Ponce de Leon"
+__copyright__ = "Copyright 2020, Tools for PhysiCell project"
+__credits__ = ["Miguel Ponce de Leon"]
+__license__ = "GNU"
+__version__ = "0.1.0"
+__maintainer__ = "Miguel Ponce de Leon"
+__email__ = "miguel.ponce@bsc.es"
+__status__ = "dev"
+
+# The scripts are in the root folder and the library modules in modules/
+_root_path = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+for _path in (_root_path, os.path.join(_root_path, "modules")):
+    if _path not in sys.path:
+        sys.path.append(_path)
+
+_modules = ("multicellds", "matreader", "physiboss", "povrender", "spatialindex",
+            "microenvironment", "spatialstats",
+            "trajectories", "plot_time_course", "povwriter", "consolidate")
+
+# Public names and the module defining them
+_attributes = {
+    "MultiCellDS": "multicellds",
+    "PhaseCounter": "multicellds",
+    "get_cells_format": "multicellds",
+    "read_mat_matrix": "matreader",
+    "SpatialIndex": "spatialindex",
+    "PovRenderer": "povrender",
+    "Mesh": "microenvironment",
+    "read_mesh": "microenvironment",
+    "Neighbours": "spatialstats",
+    "Tracks": "trajectories",
+    }
+
+
+def __getattr__(name):
+    if name in _modules:
+        value = importlib.import_module(name)
+    elif name in _attributes:
+        value = getattr(importlib.import_module(_attributes[name]), name)
+    else:
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_modules) | set(_attributes))
@@ -1,16 +1,9 @@
 #!/usr/bin/env python3
 # coding: utf-8
 
-import os, re, sys
-import glob, json
+import os, sys, time
 import argparse
-
-import numpy as np
-import pandas as pd
-from scipy.io import loadmat
-
-import matplotlib.pyplot as plt
-import seaborn as sns
+import xml.etree.ElementTree as ET
 
 __author__ = "Miguel Ponce de Leon"
 __copyright__ = "Copyright 2020, Tools for PhysiCell project"
@@ -27,9 +20,8 @@ sys.path.append(modules_path)
 
 import multicellds 
 
-
-sns.set(style="ticks", palette="Paired")
-sns.set_context('paper')
+# pandas, matplotlib and seaborn are imported when they are used, so --help 
+# and csv only runs (--no-figure) start fast
 
 def read_csv():
     # reading a cell_output file (plain text ; separated columns)
@@ -54,71 +46,90 @@ def create_parser():
     parser.add_argument("--figout", action="store", dest="fig_fname", default="./cell_vs_time.png",
                         help="File name to save the plot")
                         
+    parser.add_argument("--no-figure", action="store_false", dest="plot_figure",
+                        help="Do not create the figure (e.g. to only write the csv file)")
+
     parser.add_argument("--csvout", action="store", dest="csv_fname", default=None,
                         help="File name to store the summary table used for the plot")
 
-    return parser
-    
+    parser.add_argument("--workers", action="store", dest="workers", type=int, default=1,
+                        help="Number of output files read in parallel")
 
-def pb_output_iterator(data_folder, sep=";"):
-    globing = os.path.join(data_folder, "cells_[0-9]*.txt")
-    for fname in sorted(glob.glob(globing)):
-        df = pd.read_csv(fname, sep=sep)
-        t = df.Time[0]
-        yield (t, df)
+    parser.add_argument("--incremental", action="store_true", dest="incremental",
+                        help="Append to an existing --csvout file, reading only the output files saved after its last time step")
 
-def count_pb_files(data_folder):
-    globing = os.path.join(data_folder, "cells_[0-9]*.txt")
-    return len(glob.glob(globing))
+    parser.add_argument("--watch", action="store", dest="watch", type=float, nargs="?", const=60., default=None,
+                        help="Keep following the data folder of a running simulation, updating the csv and the figure every WATCH seconds (60 by default)")
 
-def main():
-   
-    parser = create_parser()
-    args = parser.parse_args()
-    
-    phases_dict = multicellds.default_phases_dict
-    phase_grouping = multicellds.default_phase_grouping
-    
-    # Globing output files according to the output format specified
-    if args.format == 'physicell':
-        phase_col = "current_phase"
-        mcds = multicellds.MultiCellDS(output_folder=args.data_folder)
-        df_iterator = mcds.cells_as_frames_iterator()
-        num_of_files = mcds.cells_file_count()
-    elif args.format == 'physiboss':
-        phase_col = "phase"
-        df_iterator = pb_output_iterator(args.data_folder)
-        num_of_files = count_pb_files(args.data_folder)
-    
-    # Initializing a Pandas Databrafe to store the data
-    columns = ["time", "live", "apoptotic", "necrotic"]
-    data = np.zeros((num_of_files, 4), dtype=int)
-    df_time_course = pd.DataFrame(columns=columns, data=data)
-
-    print("Reading cell_output files from %i input files from %s" % (num_of_files, args.data_folder))
-    # Iterating over all cell_output files
-    for i, (t, df) in enumerate(df_iterator):
-        print("\tProcessing time step: %.0f" % t)
-
-        # Rename the phases integer codes using the phases_dict as the mapping
-        s = df[phase_col]
-        s.replace(to_replace=phases_dict, value=None, inplace=True)
-        
-        # Count the number of cells in each phase
-        counts = s.value_counts()
-    
-        df_time_course.loc[i, 'time'] = t
-        print("time:", t)
-        # group the previous phases count into the three general classes:
-        # Alive, Apoptotic, Necrotic
-        for k, v in counts.to_dict().items():
-            if k not in phase_grouping:
-                continue
-            df_time_course.loc[i, phase_grouping[k]] += v
-            
+    return parser
     
+
+def count_time_course(mcds, counter, snapshots, workers=1):
+    # Count the number of cells in each phase, grouped into the three 
+    # general classes: Alive, Apoptotic, Necrotic
+    # "phase" is mapped to the phase column of each format
+    matrix_iterator = mcds.cells_as_matrix_iterator(columns=["phase"], workers=workers, snapshots=snapshots)
+    phases_iterator = ((t, m[:, 0]) for t, m in matrix_iterator)
     
-    # Set time column as the dataframe index
+    def progress(iterator):
+        for t, phases in iterator:
+            print("\tProcessing time step: %.0f" % t)
+            yield t, phases
+
+    df_time_course = counter.time_course(progress(phases_iterator))
+    # Integer times are written as such, fractional ones (e.g. PhysiBoSS) are
+    # kept as they are since --incremental resumes after the last one written
+    times = df_time_course["time"]
+    if (times == times.round()).all():
+        df_time_course["time"] = times.astype(int)
+    return df_time_course
+
+
+def read_time_course(csv_fname):
+    import pandas as pd
+
+    df_time_course = pd.read_csv(csv_fname, sep="\t", index_col=0)
+    return df_time_course.reset_index(drop=True)
+
+
+def update_time_course(mcds, counter, df_time_course, args):
+    """
+    Counts the snapshots saved after the last time step of df_time_course 
+    (all of them if it is None) and appends them to the table and to the 
+    csv file. Returns the updated table and the number of new time steps.
+    """
+    import pandas as pd
+
+    if df_time_course is None or len(df_time_course) == 0:
+        snapshots = mcds.snapshots
+    else:
+        snapshots = mcds.snapshots_after(df_time_course["time"].iloc[-1])
+    if len(snapshots) == 0:
+        return df_time_course, 0
+
+    print("Reading cell_output files from %i input files from %s" % (len(snapshots), args.data_folder))
+    df_new = count_time_course(mcds, counter, snapshots, workers=args.workers)
+
+    if df_time_course is None or len(df_time_course) == 0:
+        df_time_course = df_new
+        if args.csv_fname:
+            df_time_course.to_csv(args.csv_fname, sep="\t")
+            print("Saving csv as %s" % args.csv_fname)
+    else:
+        df_new.index += len(df_time_course)
+        df_time_course = pd.concat([df_time_course, df_new])
+        if args.csv_fname:
+            df_new.to_csv(args.csv_fname, sep="\t", mode="a", header=False)
+            print("Appending %i time steps to %s" % (len(df_new), args.csv_fname))
+
+    return df_time_course, len(df_new)
+
+
+def plot_time_course(df_time_course, fig_fname):
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    sns.set(style="ticks", palette="Paired")
     sns.set_context('paper')
     patch_color = "lightgrey"
     
@@ -152,12 +163,54 @@ def main():
     
     # Saving fig
     fig.tight_layout()
-    fig.savefig(args.fig_fname)
-    print("Saving fig as %s" % args.fig_fname)
+    fig.savefig(fig_fname)
+    plt.close(fig)
+    print("Saving fig as %s" % fig_fname)
+
+
+def main(argv=None):
+    """
+    Runs the script with the given command line arguments (sys.argv by 
+    default), e.g. main(["output", "--csvout", "time_course.csv"])
+    """
+    parser = create_parser()
+    args = parser.parse_args(argv)
+    
+    counter = multicellds.PhaseCounter(multicellds.default_phases_dict, 
+                                       multicellds.default_phase_grouping)
+    
+    # The reader of the output format specified is chosen by MultiCellDS
+    mcds = multicellds.MultiCellDS(output_folder=args.data_folder, format=args.format)
     
-    if args.csv_fname:
-        df_time_course.to_csv(args.csv_fname, sep="\t")
-        print("Saving csv as %s" % args.csv_fname)
+    df_time_course = None
+    if args.incremental and args.csv_fname and os.path.exists(args.csv_fname):
+        df_time_course = read_time_course(args.csv_fname)
+        print("Found %i time steps in %s" % (len(df_time_course), args.csv_fname))
+
+    df_time_course, num_new = update_time_course(mcds, counter, df_time_course, args)
+    if df_time_course is not None and args.plot_figure:
+        plot_time_course(df_time_course, args.fig_fname)
+    
+    if args.watch is None:
+        return
+
+    # Each update only reads the output files written since the previous one
+    print("Watching %s for new output files (Ctrl-C to stop)" % args.data_folder)
+    try:
+        while True:
+            time.sleep(args.watch)
+            try:
+                mcds.refresh()
+                df_time_course, num_new = update_time_course(mcds, counter, df_time_course, args)
+            except (OSError, ValueError, ET.ParseError) as e:
+                # Files still being written by the simulation, retried in the next update
+                print("Skipping update: %s" % e)
+                continue
+            if num_new and args.plot_figure:
+                plot_time_course(df_time_course, args.fig_fname)
+    except KeyboardInterrupt:
+        pass
 
-main()
 
+if __name__ == "__main__":
+    main()
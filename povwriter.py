@@ -1,15 +1,15 @@
 #!/usr/bin/env python3
 # coding: utf-8
 
-import sys, os, re, json
+import sys, os, re, io, json, glob
 from math import pi, sin, cos
 
 import argparse
 import numpy as np
-from scipy.io import loadmat
 import xml.etree.ElementTree as ET
 
 import multiprocessing as mp
+import queue
 
 
 __author__ = "Miguel Ponce de Leon"
@@ -21,6 +21,14 @@ __maintainer__ = "Miguel Ponce de Leon"
 __email__ = "miguel.ponce@bsc.es"
 __status__ = "dev"
 
+modules_path = os.path.dirname(os.path.realpath(__file__))
+modules_path = os.path.join(modules_path, 'modules')
+sys.path.append(modules_path)
+
+import multicellds
+import povrender
+import spatialindex
+
 
 default_POV_options = None
 options = None
@@ -31,13 +39,14 @@ cell_color_definitions[0]["cytoplasm"] = [1,1,1,0]
 cell_color_definitions[0]["nuclear"] = [.5,.5,.5,0]
 cell_color_definitions[0]["finish"] = [0.05,1,0.1]
 
-pc_columns_index_dict = { "cyto_volume": 4, "cell_type": 5, "phase": 7, "nuc_volume": 9}
-pb_columns_index_dict = { "cyto_radius": 4, "cell_type": 11, "phase": 13, "nuc_radius": 6}
-
-columns_index_dict = {}
-read_cells_file = None
-
-columns_index_dict = {}
+# Columns read from the cells files of each format, by their format independent 
+# name (see multicellds.CellsFormat). Cell matrices have the columns in this order
+pov_columns = {
+    "physicell": ["ID", "x", "y", "z", "cell_type", "phase", "volume", "nuclear_volume"],
+    "physiboss": ["ID", "x", "y", "z", "cell_type", "phase", "radius", "nuclear_radius"]
+    }
+pov_columns_index = {fmt: {name: i for i, name in enumerate(columns)} 
+                     for fmt, columns in pov_columns.items()}
 
 phase_grouping = { 
     "Ki67_positive_premitotic": "live",  
@@ -118,7 +127,7 @@ class Clipping_Plane:
 class Options:
     def __init__(self, folder="sample", filebase="output", format="physicell",
                  time_index=3696, camera_distance=1500, nuclear_offset=0.1, cell_bound=750, 
-                 threads=1):
+                 threads=1, pov_style="plain", out_format="pov"):
 
         self.folder = folder
         self.filebase = filebase
@@ -132,6 +141,31 @@ class Options:
         self.nuclear_offset = nuclear_offset
         self.cell_bound = cell_bound
         self.threads = threads
+        self.pov_style = pov_style
+        # Optional spatialindex region, only the cells (partly) inside it are written
+        self.region = None
+        
+        # Level of detail: skip hidden nuclei and occluded cells, optionally 
+        # merging the cells farther than lod_blob_distance from the camera into blobs
+        self.lod = False
+        self.lod_voxel_size = None
+        self.lod_blob_distance = None
+        self.lod_blob_threshold = 0.6
+        
+        # PNG rendering
+        self.out_format = out_format
+        self.renderer = None
+        self.pov_stdin = False
+        self.force = False
+
+    def create_file_globing(self):
+        if self.format == 'physicell':
+            globing = "%s/%s*_cells_physicell.mat" % (self.folder, self.filebase)
+        elif self.format == 'physiboss':
+            globing = "%s/cells_[0-9]*.txt" % self.folder
+        else:
+            globing = None
+        return globing
 
     def create_file_name(self, index):
         if self.format == 'physicell':
@@ -302,131 +336,283 @@ def write_pov_header(fh, pov_options):
     fh.write("  fade_power %i\n" % (pov_options.light_fade_power) )
     fh.write("}\n\n")
 
-def write_all_cells(fh, cells, options, pov_options):
-    bound = options.cell_bound
-    for i,row in enumerate(cells):
-        if row[1] < -bound or bound < row[1]:
-            continue
-        if row[2] < -bound or bound < row[2]:
-            continue
-        if row[3] < -bound or bound < row[3]:
-            continue
-        
-        write_cell(fh, row, pov_options, options)
-
-def write_cell(fh, row, pov_options, options):
+def get_materials():
+    """
+    Returns the color definitions (materials) of the config as a list together
+    with a (cell_type x phase) lookup table storing the index of the material
+    of each combination (-1 when it is not defined)
+    """
+    materials = []
+    material_index = {}
+    max_type = max(cell_color_definitions.keys())
+    max_phase = max(phases_dict.keys())
+    lut = np.full((max_type+1, max_phase+1), -1, dtype=int)
+    for cell_type, phase_color_dict in cell_color_definitions.items():
+        for phase, phase_name in phases_dict.items():
+            group = phase_grouping.get(phase_name)
+            if group not in phase_color_dict:
+                continue
+            key = (cell_type, group)
+            if key not in material_index:
+                material_index[key] = len(materials)
+                materials.append(phase_color_dict[group])
+            lut[cell_type, phase] = material_index[key]
+    return materials, lut
+
+def get_cells_materials(cells, options, lut):
+    columns_index_dict = pov_columns_index[options.format]
+    cell_types = cells[:, columns_index_dict["cell_type"]].astype(int)
+    phases = cells[:, columns_index_dict["phase"]].astype(int)
     
-    cell_type_index = columns_index_dict["cell_type"]
-    phase_idx = columns_index_dict["phase"]
+    valid = (0 <= cell_types) & (cell_types < lut.shape[0]) & (0 <= phases) & (phases < lut.shape[1])
+    materials = np.full(len(cells), -1, dtype=int)
+    materials[valid] = lut[cell_types[valid], phases[valid]]
     
-    cell_type = int(row[cell_type_index])
-    current_phase_idx = int(row[phase_idx])
-    
-    current_phase_name = phases_dict[current_phase_idx]
-    current_phase_name = phase_grouping[current_phase_name]
-    colors = cell_color_definitions[cell_type][current_phase_name]
-
-    center = row[1:4]
-
-    # cytoplasm radius
+    undefined = np.flatnonzero(materials < 0)
+    if len(undefined):
+        i = undefined[0]
+        raise KeyError("No color definition for cell type %i and phase %i" % (cell_types[i], phases[i]))
+    return materials
+
+def get_cells_radius(cells, options, nuclear=False):
+    columns_index_dict = pov_columns_index[options.format]
     if options.format == 'physiboss':
-        col_idx = columns_index_dict["cyto_radius"]
-        radius = row[col_idx]
-    elif options.format == 'physicell':
-        col_idx = columns_index_dict["cyto_volume"]
-        radius = pow( 3/(4*pi) * abs(row[col_idx]), (1./3.) )
+        col_idx = columns_index_dict["nuclear_radius" if nuclear else "radius"]
+        radius = np.asarray(cells[:, col_idx], dtype=float)
+    else:
+        col_idx = columns_index_dict["nuclear_volume" if nuclear else "volume"]
+        radius = np.power( 3/(4*pi) * np.abs(cells[:, col_idx]), (1./3.) )
+    return radius
+
+def get_render_modes(index, options, pov_options, radius, nuclear_radius):
+    """
+    Returns a (cells x part) array with the render mode of the cytoplasm and
+    the nucleus of every cell: 0 not rendered, 1 whole sphere and 2 sphere 
+    intersected with the clipping planes (see spatialindex.HalfSpaces)
+    """
+    coefficients = [cp.coefficients for cp in pov_options.clipping_planes]
+    planes = spatialindex.HalfSpaces(coefficients, union=True)
+    modes = np.empty((len(index), 2), dtype=int)
+    modes[:, 0] = index.classify(planes, radius=radius)
+    modes[:, 1] = index.classify(planes, radius=nuclear_radius + options.nuclear_offset)
+    return modes
+
+def pov_sphere_template(pigment, finish, no_shadow=False, no_reflection=False):
+    # POV-Ray sphere with the center and radius left as format fields
+    template = "sphere\n{\n"
+    template += " <%.4f,%.4f,%.4f>, %.4f"
+    template += (" pigment {color rgb<%.2f,%.2f,%.2f>}\n" % (pigment[0],pigment[1],pigment[2])).replace("%", "%%")
+    template += (" finish {ambient %.2f diffuse %.2f specular %.2f}\n" % (finish[0],finish[1],finish[2])).replace("%", "%%")
+    if no_shadow:
+        template += " no_shadow "
+    if no_reflection:
+        template += " no_reflection "
+    template += "}\n"
+    return template
+
+def pov_clipped_template(sphere_template, pigment, finish, clipping_planes, offset=0.):
+    planes = ""
+    for cp in clipping_planes:
+        planes += "plane{<%.3f,%.3f,%.3f>,%.3f\n" % (cp.coefficients[0], cp.coefficients[1], 
+                                                     cp.coefficients[2], cp.coefficients[3]+offset)
+        planes += " pigment {color rgb<%.3f,%.3f,%.3f>}\n" % (pigment[0], pigment[1], pigment[2])
+        planes += " finish {ambient %.3f diffuse %.3f specular %.3f } }\n" % (finish[0], finish[1], finish[2])
+    template = "intersection{ \nunion{ \n" + planes.replace("%", "%%") + "} \n" 
+    template += sphere_template + "}\n"
+    return template
+
+def get_cell_templates(materials, pov_options, options):
+    """
+    Returns a (material x part x render mode) array with the text of each cell 
+    part (0: cytoplasm, 1: nucleus) as a format string of its center and radius
+    """
+    templates = np.empty((len(materials), 2, 3), dtype=object)
+    templates[:] = ""
+    planes = pov_options.clipping_planes
+    for i, colors in enumerate(materials):
+        sphere = pov_sphere_template(colors["cytoplasm"], colors["finish"])
+        templates[i, 0, 1] = sphere
+        templates[i, 0, 2] = pov_clipped_template(sphere, colors["cytoplasm"], colors["finish"], planes)
+        sphere = pov_sphere_template(colors["nuclear"], colors["finish"], no_shadow=True)
+        templates[i, 1, 1] = sphere
+        templates[i, 1, 2] = pov_clipped_template(sphere, colors["nuclear"], colors["finish"], planes,
+                                                  offset=options.nuclear_offset)
+    return templates
+
+def get_macro_cell_templates(materials):
+    # Cells written as calls to the macros of write_pov_declarations, the 
+    # material is passed as its declared texture
+    templates = np.empty((len(materials), 2, 3), dtype=object)
+    templates[:] = ""
+    for i in range(len(materials)):
+        templates[i, 0, 1] = "C(%.4f,%.4f,%.4f,%.4f," + "M%iC)\n" % i
+        templates[i, 0, 2] = "CC(%.4f,%.4f,%.4f,%.4f," + "M%iC)\n" % i
+        templates[i, 1, 1] = "N(%.4f,%.4f,%.4f,%.4f," + "M%iN)\n" % i
+        templates[i, 1, 2] = "NC(%.4f,%.4f,%.4f,%.4f," + "M%iN)\n" % i
+    return templates
+
+def write_pov_declarations(fh, materials, options, pov_options):
+    """
+    Writes the compact (macro) scene header: one texture per material and 
+    cell part, the union of the clipping planes and the macros used to write 
+    each cell part in a single line
+    """
+    for i, colors in enumerate(materials):
+        finish = colors["finish"]
+        for part, suffix in (("cytoplasm", "C"), ("nuclear", "N")):
+            pigment = colors[part]
+            fh.write("#declare M%i%s = texture { pigment {color rgb<%.3f,%.3f,%.3f>} " % (i, suffix, pigment[0], pigment[1], pigment[2]))
+            fh.write("finish {ambient %.3f diffuse %.3f specular %.3f} }\n" % (finish[0], finish[1], finish[2]))
+    fh.write("\n")
+
+    fh.write("#macro C(X,Y,Z,R,T) sphere{<X,Y,Z>,R texture{T}} #end\n")
+    fh.write("#macro N(X,Y,Z,R,T) sphere{<X,Y,Z>,R texture{T} no_shadow} #end\n")
+    if len(pov_options.clipping_planes) == 0:
+        fh.write("\n")
+        return
+
+    for name, offset in (("ClipC", 0.), ("ClipN", options.nuclear_offset)):
+        fh.write("#declare %s = union {\n" % name)
+        for cp in pov_options.clipping_planes:
+            fh.write(" plane{<%.3f,%.3f,%.3f>,%.3f}\n" % (cp.coefficients[0], cp.coefficients[1], 
+                                                         cp.coefficients[2], cp.coefficients[3]+offset))
+        fh.write("}\n")
+    fh.write("#macro CC(X,Y,Z,R,T) intersection{ object{ClipC texture{T}} sphere{<X,Y,Z>,R texture{T}} } #end\n")
+    fh.write("#macro NC(X,Y,Z,R,T) intersection{ object{ClipN texture{T}} sphere{<X,Y,Z>,R texture{T} no_shadow} } #end\n")
+    fh.write("\n")
+
+def get_occluded_cells(centers, rendered, voxel_size):
+    """
+    Marks the rendered cells lying in a voxel whose 26 neighbour voxels are 
+    all occupied by rendered cells, such cells can not be seen from outside
+    """
+    occluded = np.zeros(len(centers), dtype=bool)
+    if not rendered.any():
+        return occluded
     
-    render = len(pov_options.clipping_planes) == 0
-    intersect = False
-    for i,cp in enumerate(pov_options.clipping_planes):
-        dist = cp.signed_distance_to_plane(center)
-        if dist <= -radius:
-            render = True
-        if -radius < dist <= radius:
-            render = True
-            intersect = True
+    # One empty voxel of padding at each side
+    lo = centers[rendered].min(axis=0) - voxel_size
+    ijk = np.floor((centers[rendered] - lo) / voxel_size).astype(int)
+    shape = tuple(ijk.max(axis=0) + 2)
+    occupied = np.zeros(shape, dtype=bool)
+    occupied[tuple(ijk.T)] = True
     
-    if intersect:
-        fh.write("intersection{ \n")
-    if render:
-        if intersect:
-            fh.write("union{ \n")
-            for cp in pov_options.clipping_planes:
-                fh.write("plane{<")
-                fh.write("%.3f," % cp.coefficients[0])
-                fh.write("%.3f," % cp.coefficients[1])
-                fh.write("%.3f>," % cp.coefficients[2])
-                fh.write("%.3f\n" % cp.coefficients[3])
-                fh.write(" pigment {color rgb<")
-                fh.write("%.3f," % colors["cytoplasm"][0])
-                fh.write("%.3f," % colors["cytoplasm"][1])
-                fh.write("%.3f>}\n" % colors["cytoplasm"][2])
-                fh.write(" finish {ambient %.3f " % colors["finish"][0] )
-                fh.write("diffuse %.3f " % colors["finish"][1] )
-                fh.write("specular %.3f } }\n" % colors["finish"][2] )
-            fh.write("} \n")
-        write_pov_sphere(fh, center, radius, colors["cytoplasm"], colors["finish"])
-    if intersect:
-        fh.write("}\n")    
-
-    nuclear_offset = options.nuclear_offset
-    # nuclear radius
-    if options.format == 'physiboss':
-        col_idx = columns_index_dict["nuc_radius"]
-        radius = row[col_idx]
-    else:
-        col_idx = columns_index_dict["nuc_volume"]
-        radius = pow( 3/(4*pi) * abs(row[col_idx]), (1./3.) )
+    interior = occupied.copy()
+    core = tuple(slice(1, n-1) for n in shape)
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            for dz in (-1, 0, 1):
+                shifted = tuple(slice(1+d, n-1+d) for d, n in zip((dx, dy, dz), shape))
+                interior[core] &= occupied[shifted]
+    interior[0, :, :] = interior[-1, :, :] = False
+    interior[:, 0, :] = interior[:, -1, :] = False
+    interior[:, :, 0] = interior[:, :, -1] = False
+    
+    occluded[rendered] = interior[tuple(ijk.T)]
+    return occluded
+
+def apply_lod(centers, radius, modes, options, pov_options):
+    """
+    Level of detail reduction of the render modes of the cells (in place): 
+    occluded whole cells are not written, nor the nuclei of the whole cells 
+    (hidden by their cytoplasm). Returns the mask of the cells to be written 
+    as blob components (whole cells far from the camera) instead of spheres.
+    """
+    whole = modes[:, 0] == spatialindex.VISIBLE
     
-    render = len(pov_options.clipping_planes) == 0
-    intersect = False
-    for i,cp in enumerate(pov_options.clipping_planes):
-        dist = cp.signed_distance_to_plane(center)        
-        if dist <= -(radius+nuclear_offset):
-            render = True
-        if -(radius+nuclear_offset) < dist <= (radius+nuclear_offset):
-            render = True
-            intersect = True
+    voxel_size = options.lod_voxel_size
+    if voxel_size is None and len(radius):
+        voxel_size = 2 * np.median(radius)
+    if voxel_size:
+        occluded = whole & get_occluded_cells(centers, modes[:, 0] > 0, voxel_size)
+        modes[occluded] = 0
+        whole &= ~occluded
+    modes[whole, 1] = 0
     
-    if intersect > 0:
-        fh.write("intersection{ \n")
-    if render:
-        if intersect:
-            fh.write("union{ \n")
-            for cp in pov_options.clipping_planes:
-                fh.write("plane{<")
-                fh.write("%.3f," % cp.coefficients[0])
-                fh.write("%.3f," % cp.coefficients[1])
-                fh.write("%.3f>," % cp.coefficients[2])
-                fh.write("%.3f\n" % (cp.coefficients[3]+nuclear_offset))
-                fh.write(" pigment {color rgb<")
-                fh.write("%.3f," % colors["nuclear"][0])
-                fh.write("%.3f," % colors["nuclear"][1])
-                fh.write("%.3f>}\n" % colors["nuclear"][2])
-                fh.write(" finish {ambient %.3f " % colors["finish"][0] )
-                fh.write("diffuse %.3f " % colors["finish"][1] )
-                fh.write("specular %.3f } }\n" % colors["finish"][2] )
-            fh.write("} \n")
-        write_pov_sphere(fh, center, radius, colors["nuclear"], colors["finish"], no_shadow=True)
-    if intersect:
+    blobs = np.zeros(len(centers), dtype=bool)
+    if options.lod_blob_distance is not None:
+        dist = np.sqrt(((centers - pov_options.camera_position)**2).sum(axis=1))
+        blobs = whole & (dist > options.lod_blob_distance)
+        modes[blobs] = 0
+    return blobs
+
+def write_blobs(fh, centers, radius, cell_materials, materials, options):
+    # A blob component of radius R and strength 1 has its surface at 
+    # R*sqrt(1 - sqrt(threshold)), the component radius is scaled so that 
+    # each cell keeps its radius
+    threshold = options.lod_blob_threshold
+    scale = 1. / np.sqrt(1 - np.sqrt(threshold))
+    for i, colors in enumerate(materials):
+        selected = cell_materials == i
+        if not selected.any():
+            continue
+        values = np.column_stack((centers[selected], radius[selected] * scale))
+        fh.write("blob {\n threshold %.3f\n" % threshold)
+        fh.write(" sphere { <%.4f,%.4f,%.4f>, %.4f, 1 }\n" * len(values) % tuple(values.ravel().tolist()))
+        if options.pov_style == "macro":
+            fh.write(" texture{M%iC}\n" % i)
+        else:
+            pigment = colors["cytoplasm"]
+            finish = colors["finish"]
+            fh.write(" pigment {color rgb<%.2f,%.2f,%.2f>}\n" % (pigment[0],pigment[1],pigment[2]))
+            fh.write(" finish {ambient %.2f diffuse %.2f specular %.2f}\n" % (finish[0],finish[1],finish[2]))
         fh.write("}\n")
 
-def write_pov_sphere(fh, center, radius, pigment, finish, no_shadow=False, no_reflection=False):
-    fh.write("sphere\n{\n")
-    fh.write(" <%.4f,%.4f,%.4f>, %.4f" % (center[0], center[1], center[2], radius) )
-    fh.write(" pigment {color rgb<%.2f,%.2f,%.2f>}\n" % (pigment[0],pigment[1],pigment[2]) )
-    fh.write(" finish {ambient %.2f diffuse %.2f specular %.2f}\n" % (finish[0],finish[1],finish[2]) )
-    if no_shadow:
-        fh.write(" no_shadow ")
-    if no_reflection:
-        fh.write(" no_reflection ")
-    fh.write("}\n")
+def format_cells(centers, radius, nuclear_radius, modes, cell_materials, templates):
+    # Builds the text of a batch of cells with a single formatting operation:
+    # the templates of every rendered part are joined and filled with a flat 
+    # tuple of centers and radii
+    values = np.empty((len(centers), 2, 4))
+    values[:, :, :3] = centers[:, None, :]
+    values[:, 0, 3] = radius
+    values[:, 1, 3] = nuclear_radius
+    
+    rendered = modes.ravel() > 0
+    parts = templates[cell_materials[:, None], [0, 1], modes].ravel()[rendered]
+    values = values.reshape(-1, 4)[rendered]
+    return "".join(parts) % tuple(values.ravel().tolist())
+
+def write_all_cells(fh, cells, options, pov_options, batch_size=10000):
+    centers = np.asarray(cells[:, 1:4], dtype=float)
+    index = spatialindex.SpatialIndex(centers)
+
+    # Only cells centered in the cell_bound cube are written
+    bound = options.cell_bound
+    inside = index.classify(spatialindex.Box([-bound]*3, [bound]*3)) != spatialindex.CULLED
+    radius = get_cells_radius(cells, options)
+    if options.region is not None:
+        inside &= index.classify(options.region, radius=radius) != spatialindex.CULLED
+    nuclear_radius = get_cells_radius(cells, options, nuclear=True)
+    modes = get_render_modes(index, options, pov_options, radius, nuclear_radius)
+    
+    cells = cells[inside]
+    centers = centers[inside]
+    radius = radius[inside]
+    nuclear_radius = nuclear_radius[inside]
+    modes = modes[inside]
+    blobs = None
+    if options.lod:
+        blobs = apply_lod(centers, radius, modes, options, pov_options)
+    
+    materials, lut = get_materials()
+    if options.pov_style == "macro":
+        write_pov_declarations(fh, materials, options, pov_options)
+        templates = get_macro_cell_templates(materials)
+    else:
+        templates = get_cell_templates(materials, pov_options, options)
+    cell_materials = get_cells_materials(cells, options, lut)
+    for start in range(0, len(cells), batch_size):
+        batch = slice(start, start + batch_size)
+        fh.write(format_cells(centers[batch], radius[batch], nuclear_radius[batch], 
+                              modes[batch], cell_materials[batch], templates))
+    if blobs is not None and blobs.any():
+        write_blobs(fh, centers[blobs], radius[blobs], cell_materials[blobs], materials, options)
 
 def write_pov_file(idx, pov_options, options):
 
     fname = options.create_file_name(idx)
     print("Processing file ", fname)
-    mat = read_cells_file(fname)
+    mat = read_cells_file(fname, options)
     print("Matrix size: %i x %i " % mat.shape)
     
     pov_fname = fname[:-4] + ".pov"
@@ -439,21 +625,42 @@ def write_pov_file(idx, pov_options, options):
     
     return False
 
-def physicell_read_file(fname):
-    mat = loadmat(fname)['cells'].T
-    return mat
+def write_png_file(idx, pov_options, options):
+    """
+    Renders the frame idx into a PNG image, unless the image is newer than 
+    both the cells file and the .pov file. Returns the status of the frame.
+    """
+    fname = options.create_file_name(idx)
+    pov_fname = fname[:-4] + ".pov"
+    png_fname = povrender.png_file_name(pov_fname)
+    if not options.force and povrender.is_up_to_date(png_fname, fname, pov_fname):
+        print("Skipping %s, it is up to date" % png_fname)
+        return povrender.SKIPPED
+
+    if options.pov_stdin:
+        # The scene is piped to the renderer without writing the .pov file
+        print("Processing file ", fname)
+        mat = read_cells_file(fname, options)
+        fh = io.StringIO()
+        write_pov_header(fh, pov_options)
+        write_all_cells(fh, mat, options, pov_options)
+        success, message = options.renderer.render(pov_fname, png_fname, scene=fh.getvalue())
+        status = povrender.DONE if success else povrender.FAILED
+    else:
+        write_pov_file(idx, pov_options, options)
+        _, status, message = povrender.render_file(options.renderer, pov_fname, png_fname, force=True)
+    
+    if status == povrender.FAILED:
+        print("Error rendering %s: %s" % (png_fname, message))
+    else:
+        print("Rendered %s" % png_fname)
+    return status
 
-def physiboss_read_file(fname, sep=";"):
-    data = []
-    with open(fname) as fh:
-        header = next(fh)
-        for row in fh:
-            data.append([float(i) for i in row.split(";")])
-        data = np.array(data)
-        # Removing time storing column
-        data = data[:,1:]
-    print(data[:,4].max())
-    return data
+def read_cells_file(fname, options):
+    # The reader of the format maps the named columns to the ones of the file
+    columns = pov_columns[options.format]
+    mat = options.cells_format.read_cells_matrix(fname, columns=columns)
+    return mat
 
 def create_parser():
 
@@ -475,74 +682,202 @@ def create_parser():
     parser.add_argument("--out-format", action="store", dest="out_format", default="pov",
                         choices=('pov', 'png'), help="Output format")
 
+    parser.add_argument("--threads", action="store", dest="threads", type=int, default=None,
+                        help="Number of worker processes (overrides the threads option of the XML config)")
+
+    parser.add_argument("--chunksize", action="store", dest="chunksize", type=int, default=None,
+                        help="Number of frames sent to a worker at once (by default it is computed from the number of frames, at most 4)")
+
+    parser.add_argument("--pov-style", action="store", dest="pov_style", default="plain",
+                        choices=("plain", "macro"), 
+                        help="Style of the .pov files: plain writes every cell in full, macro declares the materials and clipping planes once and writes each cell as a macro call (smaller files, faster parsing)")
+
+    parser.add_argument("--roi-box", action="store", dest="roi_box", default=None,
+                        help="Only write the cells inside the box x0,y0,z0,x1,y1,z1 (e.g. a slab)")
+
+    parser.add_argument("--roi-sphere", action="store", dest="roi_sphere", default=None,
+                        help="Only write the cells inside the sphere x,y,z,radius")
+
+    parser.add_argument("--lod", action="store_true", dest="lod",
+                        help="Level of detail mode: nuclei of unclipped cells and cells occluded by their neighbours are not written")
+
+    parser.add_argument("--lod-voxel-size", action="store", dest="lod_voxel_size", type=float, default=None,
+                        help="Voxel size of the occupancy grid used to find occluded cells (by default twice the median cell radius, 0 disables it)")
+
+    parser.add_argument("--lod-blob-distance", action="store", dest="lod_blob_distance", type=float, default=None,
+                        help="In level of detail mode, cells farther than this distance from the camera are merged into blobs")
+
+    parser.add_argument("--povray", action="store", dest="povray", default="povray",
+                        help="POV-Ray executable used to render the png files")
+
+    parser.add_argument("--width", action="store", dest="width", type=int, default=720,
+                        help="Width of the png files")
+
+    parser.add_argument("--height", action="store", dest="height", type=int, default=680,
+                        help="Height of the png files")
+
+    parser.add_argument("--pov-stdin", action="store_true", dest="pov_stdin",
+                        help="Pipe the scenes to POV-Ray instead of writing the .pov files")
+
+    parser.add_argument("--force", action="store_true", dest="force",
+                        help="Render the png files even if they are up to date")
+
     return parser
 
-def main():    
+def setup(args):
     # Makeing parameters and options storing classes global variables
-    global phases_dict
-    global phase_grouping
     global default_POV_options
     global options
-    global pigment_and_finish_function
-    global cell_color_definitions
-    global read_cells_file
-    global columns_index_dict
-
-    #
-    parser = create_parser()
-    args = parser.parse_args()
 
     # Deafult option stoting classes
     options = Options()
     default_POV_options = POV_Options()
-    
-    ###########################################################
 
     # Loadgin XML configuration 
     load_config_file(args.xml_config)
 
-    ###########################################################
-
-
-    num_of_jobs = options.threads
     options.format = args.format
-    if args.format == 'physicell':
-        read_cells_file = physicell_read_file
-        columns_index_dict = pc_columns_index_dict
-    elif args.format == 'physiboss':
-        read_cells_file = physiboss_read_file
-        columns_index_dict = pb_columns_index_dict
-    
+    options.pov_style = args.pov_style
+    options.out_format = args.out_format
+    options.lod = args.lod
+    options.lod_voxel_size = args.lod_voxel_size
+    options.lod_blob_distance = args.lod_blob_distance
+    if args.roi_box:
+        values = [float(i) for i in args.roi_box.split(",")]
+        options.region = spatialindex.Box(values[:3], values[3:6])
+    elif args.roi_sphere:
+        values = [float(i) for i in args.roi_sphere.split(",")]
+        options.region = spatialindex.Sphere(values[:3], values[3])
+    if args.out_format == "png":
+        options.renderer = povrender.PovRenderer(args.povray, width=args.width, height=args.height)
+        options.pov_stdin = args.pov_stdin
+        options.force = args.force
+    options.cells_format = multicellds.get_cells_format(options.folder, args.format)
+
+def init_worker(args):
+    # Each worker process loads the configuration only once, frames are then 
+    # dispatched to it by index
+    setup(args)
+
+def render_frame(idx):
+    # Errors are reported per frame so that a bad file does not stop the rest
+    try:
+        if options.out_format == "png":
+            return idx, write_png_file(idx, default_POV_options, options)
+        if write_pov_file(idx, default_POV_options, options):
+            return idx, povrender.DONE
+        return idx, povrender.FAILED
+    except Exception as e:
+        print("Error processing frame %i: %s" % (idx, e))
+        return idx, povrender.FAILED
+    finally:
+        # Worker processes are terminated without flushing their output
+        sys.stdout.flush()
+
+def find_file_indexes(options):
+    # The index of a cells file is the last number of its name
+    globing = options.create_file_globing()
+    indexes = [int(re.findall(r"\d+", os.path.basename(fname))[-1]) 
+               for fname in glob.glob(globing)]
+    return sorted(indexes)
+
+def parse_indexes(strn_idxs, options):
     pattern_slices = re.compile("(\d*):(\d*):(\d*)")
     pattern_indexes = re.compile("(\d+)(,\d+)*")
     pattern_all = re.compile("^all$")
 
     index_list = []
 
-    match = re.search(pattern_slices, args.strn_idxs)
+    match = re.search(pattern_slices, strn_idxs)
     if match:
         from_idx = int(match.group(1))
         to_idx = int(match.group(2))
         inc = int(match.group(3))
         index_list = range(from_idx, to_idx, inc)
-    elif re.search(pattern_indexes, args.strn_idxs):
-        index_list = [int(i) for i in args.strn_idxs.split(",")]
-    elif re.search(pattern_all, args.strn_idxs):
-        pass
+    elif re.search(pattern_indexes, strn_idxs):
+        index_list = [int(i) for i in strn_idxs.split(",")]
+    elif re.search(pattern_all, strn_idxs):
+        index_list = find_file_indexes(options)
     else:
         index_list = [options.time_index]
     
-    if num_of_jobs > 1:
-        pool = mp.Pool(num_of_jobs)
-        results = [pool.apply(write_pov_file, args=(idx, default_POV_options, options)) 
-                        for idx in index_list]
-        pool.close()
-    else:
+    return list(index_list)
+
+def render_chunk(idxs):
+    return [render_frame(idx) for idx in idxs]
+
+def render_frames(index_list, args, num_of_jobs=1, chunksize=None, max_in_flight=None):
+    """
+    Writes the .pov (or .png) file of every index in index_list using num_of_jobs processes.
+    Yields a (idx, status) tuple for each frame, in completion order.
+    """
+    if num_of_jobs <= 1:
         for idx in index_list:
-            write_pov_file(idx, default_POV_options, options)
+            yield render_frame(idx)
+        return
+
+    if chunksize is None:
+        # Small chunks, a frame is much more work than dispatching it
+        chunksize = max(1, min(4, len(index_list) // (num_of_jobs * 4)))
+    if max_in_flight is None:
+        max_in_flight = 2 * num_of_jobs * chunksize
+    max_in_flight = max(max_in_flight, num_of_jobs * chunksize)
+
+    chunks = [index_list[i:i+chunksize] for i in range(0, len(index_list), chunksize)]
+    results = queue.Queue()
+
+    sys.stdout.flush()
+    with mp.Pool(num_of_jobs, initializer=init_worker, initargs=(args,)) as pool:
+        # At most max_in_flight frames are queued in the pool, a new chunk is 
+        # submitted each time a chunk is done
+        in_flight = 0
+        next_chunk = 0
+        while next_chunk < len(chunks) or in_flight:
+            while next_chunk < len(chunks) and in_flight + len(chunks[next_chunk]) <= max_in_flight:
+                chunk = chunks[next_chunk]
+                pool.apply_async(render_chunk, (chunk,), callback=results.put, 
+                                 error_callback=results.put)
+                in_flight += len(chunk)
+                next_chunk += 1
+
+            chunk_results = results.get()
+            if isinstance(chunk_results, BaseException):
+                raise chunk_results
+            in_flight -= len(chunk_results)
+            for result in chunk_results:
+                yield result
+
+def main(argv=None):
+    """
+    Runs the script with the given command line arguments (sys.argv by 
+    default), e.g. main(["config/povwriter-settings.xml", "--idxs", "all"])
+    """
+    parser = create_parser()
+    args = parser.parse_args(argv)
+
+    setup(args)
+
+    num_of_jobs = options.threads
+    if args.threads is not None:
+        num_of_jobs = args.threads
+
+    index_list = parse_indexes(args.strn_idxs, options)
+    print("Rendering %i frames using %i processes" % (len(index_list), num_of_jobs))
+
+    failed = []
+    frames = render_frames(index_list, args, num_of_jobs=num_of_jobs, 
+                           chunksize=args.chunksize)
+    for i, (idx, status) in enumerate(frames, 1):
+        if status == povrender.FAILED:
+            failed.append(idx)
+        print("[%i/%i] frame %i %s" % (i, len(index_list), idx, status))
+
+    if failed:
+        print("%i frames failed: %s" % (len(failed), ",".join(str(i) for i in sorted(failed))))
 
 
-main()
+if __name__ == "__main__":
+    main()
 
 # options.max_trace_level = int(0)
 # options.assumed_gamma = 0.0
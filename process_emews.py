@@ -67,4 +67,5 @@ def main():
     for p in param_names:
         print("- %s" % p)
 
-main()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -6,9 +6,20 @@ modules_path = os.path.join(modules_path, 'modules')
 sys.path.append(modules_path)
 from multicellds import *
 
+python_loader_path = "/home/oth/anaconda3/lib/python3.8/site-packages/python-loader"
 
-sys.path.append("/home/oth/anaconda3/lib/python3.8/site-packages/python-loader")
-from pyMCDS import pyMCDS # importing the pyMCDS class
+
+# MultiCellDS instances (and thus snapshot indexes) already opened, by output folder
+_datasets = {}
+
+
+def get_dataset(output_folder):
+    """ Returns the MultiCellDS instance of the given output folder, creating it only once. """
+
+    output_folder = str(output_folder)
+    if output_folder not in _datasets:
+        _datasets[output_folder] = MultiCellDS(output_folder=output_folder)
+    return _datasets[output_folder]
 
 
 def frame_loader(frame, output_folder):
@@ -17,10 +28,13 @@ def frame_loader(frame, output_folder):
     a pyMCDS instance.
     """
 
+    # python-loader is only needed here, the substrate fields are read with MultiCellDS
+    sys.path.append(python_loader_path)
+    from pyMCDS import pyMCDS
+
     output_folder = str(output_folder)
-    frame_files = [file for file in os.listdir(output_folder) if file.endswith(".xml") and file.startswith("output")]
-    frame_files.sort()
-    mcds = pyMCDS(frame_files[frame], output_folder)
+    snapshot = get_dataset(output_folder).snapshots[frame]
+    mcds = pyMCDS(os.path.basename(snapshot.xml_fname), output_folder)
 
     return mcds
 
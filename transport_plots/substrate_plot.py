@@ -15,45 +15,51 @@ modules_path = os.path.join(modules_path, 'modules')
 sys.path.append(modules_path)
 from multicellds import *
 
-python_loader_path = "/home/oth/anaconda3/lib/python3.8/site-packages/python-loader"
-sys.path.append(python_loader_path)
-from pyMCDS import pyMCDS # importing the class
-
-# TODO: Add python-loader to the tools4physicell venv, cannot do it through pip as it is not in PyPI
-
 # path in which the plots will be stored
 plots_path = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
 plots_path = os.path.join(plots_path, "transport_plots")
 gif_path = os.path.join(plots_path, "transport_gif")
 
-if not os.path.exists(plots_path):
-    os.makedirs(gif_path)
-    sys.stdout.write("Transport plots folder has been created.\n")
-else:
-    sys.stdout.write("Transport plots folder already exists.\n")
+# Set by setup() from the command line arguments
+args = None
+
+
+def setup(argv=None):
+    """ Parses the command line arguments and creates the folder where the plots are stored. """
+    global args
+
+    if not os.path.exists(plots_path):
+        os.makedirs(gif_path)
+        sys.stdout.write("Transport plots folder has been created.\n")
+    else:
+        sys.stdout.write("Transport plots folder already exists.\n")
 
-# calling the parser
-parser = plots_parser.create_parser_transport()
-args = parser.parse_args()
+    # calling the parser
+    parser = plots_parser.create_parser_transport()
+    args = parser.parse_args(argv)
 
 
-def plot_substrate(mcds, substrate, i, filename_array, type):
+def plot_substrate(mcds, frame, substrate, i, filename_array, type):
     """
     Script built from a tutorial from Paul Macklin on PhysiCell's python-loader package tutorial.
     Produces a matplotlib-based plot that contains a specific diffusing substrate on the microenvironment,
     and the agents from a PhysiCell simulation.
 
-        - mcds: pyMCDS instance
+        - mcds: MultiCellDS instance of the output folder
+        - frame: index of the snapshot to plot
         - substrate: argparser argument indicating the relevant substrate which will be shown in the plot
         - i: index to name the output figure
         - type: two options, "agents_microenv" plots both the microenvironment and the agents, while "microenv"
                 plots just the microenvironment.
     """
 
-    t = mcds.get_time()
     substrate = substrate[0]
-    pos_x = mcds.data['discrete_cells']['position_x']
-    pos_y = mcds.data['discrete_cells']['position_y']
+    # only the columns used in the plot are read from the cells file
+    columns = ["x_position", "y_position", f"Initial_E_{substrate}", f"Initial_I_{substrate}",
+               f"E_{substrate}_near", f"I_{substrate}", "total_volume", "nuclear_volume"]
+    t, cells = mcds.get_cells_frame(frame, columns=columns)
+    pos_x = cells["x_position"].values
+    pos_y = cells["y_position"].values
 
 #    cycle = mcds.data['discrete_cells']['cycle_model']  # an array
 #    cycle = cycle.astype(int)  # convert all values to integers
@@ -63,27 +69,26 @@ def plot_substrate(mcds, substrate, i, filename_array, type):
 #    dead = np.argwhere(cycle >= 100).flatten()  # flatten in order to reduce to just 1 dimension
 
     # fetch relevant variables - only need first item, as these are constants set prior to the simulation
-    initial_E_density = mcds.data['discrete_cells'][f'Initial_E_{substrate}'][0]
-    initial_I_density = mcds.data['discrete_cells'][f'Initial_I_{substrate}'][0]
-    actual_E_density = mcds.data["discrete_cells"][f"E_{substrate}_near"][0]
-    actual_I_density = mcds.data["discrete_cells"][f"I_{substrate}"][0]
-    total_volume = mcds.data["discrete_cells"]["total_volume"][0]
-    nuclear_volume = mcds.data["discrete_cells"]["nuclear_volume"][0]
+    initial_E_density = cells[f"Initial_E_{substrate}"].iloc[0]
+    initial_I_density = cells[f"Initial_I_{substrate}"].iloc[0]
+    actual_E_density = cells[f"E_{substrate}_near"].iloc[0]
+    actual_I_density = cells[f"I_{substrate}"].iloc[0]
+    total_volume = cells["total_volume"].iloc[0]
+    nuclear_volume = cells["nuclear_volume"].iloc[0]
+
+    # (nx, ny, nz) field, transposed to the (y, x) layout of the 2-D mesh
+    substrate_conc = mcds.get_substrate_field(frame, substrate)[:, :, 0].T
+    X, Y = mcds.mesh.meshgrid()
 
     if type == "agents_microenv":
         plt.clf()
 
         # plot microenvironment
-        mcds.get_substrate_names()
-        substrate_conc = mcds.get_concentrations(f'{substrate}')
-        X, Y = mcds.get_2D_mesh()
-
-        
         if initial_E_density > initial_I_density:  # ascending or descending color gradient
-            plt.contourf(X, Y, substrate_conc[:, :, 0], cmap='Blues', levels=np.linspace(0.999, 1.0, 100)) #exp A
-            # plt.contourf(X, Y, substrate_conc[:, :, 0], cmap='Blues', levels=np.linspace(0.999, initial_E_density, 100)) #exp B
+            plt.contourf(X, Y, substrate_conc, cmap='Blues', levels=np.linspace(0.999, 1.0, 100)) #exp A
+            # plt.contourf(X, Y, substrate_conc, cmap='Blues', levels=np.linspace(0.999, initial_E_density, 100)) #exp B
         else:
-            plt.contourf(X, Y, substrate_conc[:, :, 0], cmap='Blues', levels=np.linspace(0.0, actual_E_density + 1e-12, 100))
+            plt.contourf(X, Y, substrate_conc, cmap='Blues', levels=np.linspace(0.0, actual_E_density + 1e-12, 100))
 
         # TODO: Set properly the colorbars - don't make them dynamic
 
@@ -113,15 +118,12 @@ def plot_substrate(mcds, substrate, i, filename_array, type):
     elif type == "microenv":
 
         plt.clf()  # clear figure
-        mcds.get_substrate_names()
-        substrate_conc = mcds.get_concentrations(substrate)
-        X, Y = mcds.get_2D_mesh()
 
         # plt.clf()
         if initial_E_density > initial_I_density:  # ascending or descending color gradient
-            plt.contourf(X, Y, substrate_conc[:, :, 0], cmap='Blues', levels=np.linspace(0.0, initial_E_density, 1000))
+            plt.contourf(X, Y, substrate_conc, cmap='Blues', levels=np.linspace(0.0, initial_E_density, 1000))
         else:
-            plt.contourf(X, Y, substrate_conc[:, :, 0], cmap='Blues', levels=np.linspace(initial_E_density, 1.0, 100))
+            plt.contourf(X, Y, substrate_conc, cmap='Blues', levels=np.linspace(initial_E_density, 1.0, 100))
 
         plt.colorbar()
         plt.axis('off')
@@ -138,16 +140,13 @@ def substrate_plot_gif(output_folder, output_path, substrate, type="agents_micro
         - output_folder: PhysiCell output folder
         - output_path: Folder in which the subst
     """
-    # TODO: Instead of using functions from pcplotutils.py, which is built on top of PhysiCell's python-loader, just use pctk from Miguel 
-
     filenames = []
 
-    for xml_name in xml_frames_iterator(output_folder):
-        xml_index = int(xml_name.split(".")[0].split("output")[1])
-        mcds = frame_loader(xml_index, output_folder)
-
+    # The mesh and the voxel layout are read once for the whole run
+    mcds = get_dataset(output_folder)
+    for frame, snapshot in enumerate(mcds.snapshots):
         # First, plot for each frame a "substrate plot"
-        plot_substrate(mcds, substrate, xml_index, filenames, type)
+        plot_substrate(mcds, frame, substrate, snapshot.index, filenames, type)
 
     # Then, create GIF
     with imageio.get_writer(str(gif_path + "/substrate.gif"), mode="I") as writer:
@@ -208,4 +207,5 @@ def main():
 
 
 if __name__ == "__main__":
+    setup()
     main()
@@ -19,24 +19,33 @@ images_path = os.path.join(plots_path, "plots")
 
 
 
-if not os.path.exists(images_path):
-    os.makedirs(images_path)
-    sys.stdout.write("Transport plots folder has been created.\n")
-else:
-    sys.stdout.write("Transport plots folder already exists.\n")
+# Set by setup() from the command line arguments
+args = None
+substrates = None
+specific_simulation_path = None
 
-# calling the parser
-parser = plots_parser.create_parser_transport()
-args = parser.parse_args()
-substrates = args.substrates
 
-print(substrates)
+def setup(argv=None):
+    """ Parses the command line arguments and creates the folders where the plots are stored. """
+    global args, substrates, specific_simulation_path
 
-for substrate in substrates:
-    specific_simulation_path = os.path.join(images_path, f"{args.transport}_{substrate}_exp")
-    if not os.path.exists(specific_simulation_path):
-        os.makedirs(specific_simulation_path)
+    if not os.path.exists(images_path):
+        os.makedirs(images_path)
+        sys.stdout.write("Transport plots folder has been created.\n")
+    else:
+        sys.stdout.write("Transport plots folder already exists.\n")
+
+    # calling the parser
+    parser = plots_parser.create_parser_transport()
+    args = parser.parse_args(argv)
+    substrates = args.substrates
 
+    print(substrates)
+
+    for substrate in substrates:
+        specific_simulation_path = os.path.join(images_path, f"{args.transport}_{substrate}_exp")
+        if not os.path.exists(specific_simulation_path):
+            os.makedirs(specific_simulation_path)
 
 
 # TODO: Make it more user-friendly - variables from PhysiCell should include specific tags
@@ -499,7 +508,8 @@ def main():
     ## Save figures in specific folder within images_path
 
     mcds = MultiCellDS(output_folder=args.output_folder)
-    simulation_df = mcds.full_cell_info_df(group_by_time=True)  # group_by argument is deprecated
+    grouped_fname = os.path.join(args.output_folder, "full_cell_info_grouped_by_time.csv")
+    simulation_df = mcds.full_cell_info_df(group_by_time=True, output_fname=grouped_fname)  # group_by argument is deprecated
 
     transport_dfs = get_relevant_transport_dfs(simulation_df, args.substrates, args.transport)
     #simulation_info = get_relevant_constants(simulation_df, args.substrate, args.transport)
@@ -545,7 +555,7 @@ def get_just_fulldf():
         value = int(file_string.split("_")[1])
 
         mcds = MultiCellDS(output_folder=file)
-        mcds.full_cell_info_df(group_by_time=True)
+        mcds.full_cell_info_df(group_by_time=True, output_fname=f"{file}/full_data_merged_grouped_time.csv")
 
         # Copy to unit test folder
         #subprocess.run([f"cp {files_dir}/{file}/full_data_merged.csv {unit_test_path_specific}"], cwd=top_dir, shell=True)
@@ -558,6 +568,7 @@ def get_just_fulldf():
 
 if __name__ == "__main__":
 
+    setup()
     if args.just_df is True:
         get_just_fulldf()
     else: